@@ -1,85 +1,446 @@
-import matplotlib.pyplot as plt
+import argparse
+import json
+import os
+
 import numpy as np
 import pandas as pd
-import seaborn as sns
+
+import logfiles
+import metrics
+import report
+import rollup
+import store
+import tiers
+from records import status_of
+
+# bytes read from the log per iteration; peak memory of the parser
+# depends on this and not on the size of the log
+CHUNK_SIZE = 1 << 20
+
+# rough size of one date/PING/reply/stats block written by pinger.sh,
+# used to preallocate the result arrays
+BLOCK_SIZE = 256
+
+
+def clean_delay(d):
+    """
+    extract the delay (ms) from the reply line that follows a PING header
+    """
+    if not d.strip():
+        return np.inf
+    try:
+        return float(d.split()[-2][5:])
+    except (ValueError, IndexError) as err:
+        print(f"{err}\nBad line: {d}")
+        metrics.count("bad_lines")
+        return np.inf
+
+
+def iter_lines(f, chunk_size=CHUNK_SIZE, partial=True):
+    """
+    yield (end offset, line) for every line of a binary file, reading it
+    in chunks of chunk_size bytes. An unterminated last line is only
+    yielded when partial is True.
+    """
+    offset = f.tell()
+    tail = b""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        for line in lines:
+            offset += len(line) + 1
+            yield offset, line
+    if tail and partial:
+        yield offset + len(tail), tail
+
+
+def iter_records(f, chunk_size=CHUNK_SIZE, partial=True):
+    """
+    yield (end offset, time, target, delay) for every sample of an open
+    pinger.sh log, where end offset is the byte right after the reply line
+    and target is the host named by the PING header
+
+    Every sample is a block of the form
+        date
+        PING header
+        reply line (empty on timeout)
+        statistics
+    so the parser only needs to remember the previous line (the date)
+    and whether it is right after a PING header.
+    """
+    prev = ""
+    in_reply = False
+    for offset, raw in iter_lines(f, chunk_size, partial):
+        line = raw.decode(errors="replace").rstrip("\r")
+        if in_reply:
+            yield offset, time, target, clean_delay(line)
+            in_reply = False
+        elif line[:4] == "PING":
+            time = prev
+            target = line[5:].split(" ", 1)[0] or store.DEFAULT_TARGET
+            in_reply = True
+        prev = line
+
+
+def iter_log(file_name, chunk_size=CHUNK_SIZE):
+    """
+    lazily yield (time, delay) records from a pinger.sh log
+    """
+    with logfiles.open_log(file_name) as f:
+        for _, time, _, delay in iter_records(f, chunk_size):
+            yield time, delay
 
 
-def read_log(file_name):
+@metrics.timed("parse")
+def read_log_from(file_name, offset=0, chunk_size=CHUNK_SIZE, partial=True):
     """
-    read the data
+    read the samples that start at byte offset of the log (plain or
+    compressed, offsets count decompressed bytes), returns the data and
+    the offset right after the last complete sample
     """
-    with open(file_name, "r") as f:
-        logf = f.readlines()
+    capacity = max((os.path.getsize(file_name) - offset) // BLOCK_SIZE, 1)
+    times = np.empty(capacity, dtype=object)
+    targets = np.empty(capacity, dtype=object)
+    delays = np.empty(capacity, dtype=np.float64)
 
-    data_lines = [
-        (logf[i - 1], logf[i + 1])
-        for i, l in enumerate(logf)
-        if l[:4] == "PING"
+    n = 0
+    start = offset
+    with logfiles.open_log(file_name) as f:
+        if offset:
+            f.seek(offset)
+        for offset, time, target, delay in iter_records(
+            f, chunk_size, partial
+        ):
+            if n == capacity:
+                capacity *= 2
+                times.resize(capacity, refcheck=False)
+                targets.resize(capacity, refcheck=False)
+                delays.resize(capacity, refcheck=False)
+            times[n] = time
+            targets[n] = target
+            delays[n] = delay
+            n += 1
+
+    df = pd.DataFrame(
+        {
+            "time": times[:n],
+            "delay": delays[:n],
+            "status": status_of(delays[:n]),
+            "target": targets[:n],
+        }
+    )
+    metrics.count("parsed_bytes", offset - start)
+    metrics.count("parsed_samples", n)
+
+    return df, offset
+
+
+@metrics.timed("read_log")
+def read_log(file_name, chunk_size=CHUNK_SIZE):
+    """
+    read the data of a log and its rotations, or of the logs of a glob,
+    in time order
+    """
+    frames = [
+        read_log_from(name, chunk_size=chunk_size)[0]
+        for name, _, _, _ in log_files(file_name)
     ]
+    if not frames:
+        return read_log_from(os.devnull)[0]
+    return pd.concat(frames, ignore_index=True)
 
-    def clean_delay(d):
-        if d == "\n":
-            return np.inf
-        else:
-            try:
-                return float(d.split()[-2][5:])
-            except ValueError as err:
-                print(f"{err}\nBad line: {d}")
-                return np.inf
 
-    data_lines = [(t[:-1], clean_delay(d)) for t, d in data_lines]
+TIME_FORMAT = "%m/%d/%y-%H:%M:%S"
 
-    df = pd.DataFrame(data_lines, columns=["time", "delay"])
 
-    return df
+def parse_time(date_line):
+    """
+    The epoch ns of the bytes of a date line
+    """
+    return pd.to_datetime(date_line.decode(), format=TIME_FORMAT).value
 
 
-def fix_times(df):
+def log_files(pattern, known=None):
+    """
+    The (file name, first time, last time, length) of the files of
+    pattern (a log and its rotations, or a glob) that have samples,
+    ordered by their times (epoch ns), see logfiles.extent. known maps
+    file names to what an earlier call found (a dict of size, mtime,
+    first, last and length), a compressed file that did not change is not
+    read again; it is updated with what was found.
+    """
+    known = {} if known is None else known
+    files = []
+    for file_name in logfiles.rotation_set(pattern):
+        stat = os.stat(file_name)
+        seen = known.get(file_name)
+        if not (
+            seen
+            and logfiles.is_compressed(file_name)
+            and seen["size"] == stat.st_size
+            and seen["mtime"] == stat.st_mtime
+            and "length" in seen
+        ):
+            first, last, length = logfiles.extent(file_name)
+            seen = known[file_name] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "first": None if first is None else parse_time(first),
+                "last": None if last is None else parse_time(last),
+                "length": length,
+            }
+        if seen["first"] is not None:
+            files.append(
+                (file_name, seen["first"], seen["last"], seen["length"])
+            )
+    return sorted(files, key=lambda f: (f[1], f[2]))
+
+
+@metrics.timed("fix_times")
+def fix_times(df, vectorized=True):
     """
     Remove bad values from the time column
     """
+    if vectorized:
+        times = pd.to_datetime(df["time"], format=TIME_FORMAT, errors="coerce")
+        good = times.notna().to_numpy()
+        number_of_bad_times = int(len(good) - good.sum())
+        df = df[good].assign(time=times[good])
+        metrics.count("bad_times", number_of_bad_times)
+        return df, number_of_bad_times
+
     number_of_bad_times = 0
 
     for i, row in df.iterrows():
         temp = df["time"].iloc[i]
         try:
-            pd.to_datetime(temp, dayfirst=True, format="%m/%d/%y-%H:%M:%S")
+            pd.to_datetime(temp, dayfirst=True, format=TIME_FORMAT)
         except ValueError:
             number_of_bad_times += 1
             df.loc[i, "time"] = pd.to_datetime(0)
 
-    df["time"] = pd.to_datetime(
-        df["time"], dayfirst=True, format="%m/%d/%y-%H:%M:%S"
-    )
+    df["time"] = pd.to_datetime(df["time"], dayfirst=True, format=TIME_FORMAT)
 
     df = df[df["time"] != pd.to_datetime(0)]
+    metrics.count("bad_times", number_of_bad_times)
 
     return df, number_of_bad_times
 
 
-def plot_log_to_file(df):
-    plt.figure(figsize=(12, 6))
-    g = sns.scatterplot(data=df[df["delay"] != np.inf], x="time", y="delay")
-    sns.scatterplot(
-        data=df[df["delay"] == np.inf],
-        x="time",
-        y=5,
-        style="delay",
-        markers=["x"],
-        hue="delay",
-        palette=["red"],
-        ax=g,
+def load_state(state_file):
+    """
+    read the ingest state saved by the previous incremental run
+    """
+    try:
+        with open(state_file, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_state(state_file, state):
+    tmp_file = state_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+
+def first_time(file_name):
+    """
+    The time (epoch ns) of the first date line of a plain log, None when
+    it has none
+    """
+    first, _, _ = logfiles.extent(file_name)
+    return None if first is None else parse_time(first)
+
+
+def resume_offset(state, stat, first):
+    """
+    The byte offset to go on reading a plain log from, given the stat and
+    the first time of the log now and the state resume_state saved: the
+    saved offset when it is still the same file, 0 when it is another
+    one (other inode) or was truncated (it shrank, or starts with another
+    time, having been written again past the offset since)
+    """
+    if (
+        state
+        and stat.st_ino == state.get("inode")
+        and state.get("first") == first
+        and state["size"] <= stat.st_size
+    ):
+        return state["offset"]
+    return 0
+
+
+def resume_state(stat, offset, first):
+    """
+    What resume_offset needs to go on reading a plain log from offset
+    """
+    return {
+        "inode": stat.st_ino,
+        "offset": offset,
+        "size": max(stat.st_size, offset),
+        "first": first,
+    }
+
+
+@metrics.timed("ingest")
+def ingest(
+    log_file,
+    store_path,
+    state_file,
+    full=False,
+    arrays_path=store.ARRAYS_PATH,
+    rollup_path=rollup.ROLLUP_PATH,
+    version_path=store.VERSION_PATH,
+    targets_path=store.TARGETS_PATH,
+    retention_path=tiers.RETENTION_PATH,
+):
+    """
+    Parse only what is new in the log and its rotations (or in the logs
+    of a glob) and append it to the ping store, the array store and the
+    rollup, then bump the data version.
+
+    The files are read in the order of their times. The state file
+    remembers what log_files found in every file, the (first, last,
+    length) of the files that were read to their end, and the inode,
+    size and first time of the newest file with the byte offset right
+    after its last parsed sample. A file that was read to its end is
+    skipped, also after it was renamed or compressed, the file with that
+    inode is read from that offset (it is still the same file after a
+    rotation renamed it) unless it shrank or starts with another time
+    (truncated, maybe written again past the offset since), and the
+    other files are read whole, keeping only the pings whose target and
+    time are not in the store yet and that are not older than its raw
+    tier (compacted away, see tiers.py). When one of the stores is gone
+    or full is set, all the files are parsed again from the start, into
+    the raw tier and the hours after the compacted days.
+
+    The targets are stored as their codes in targets_path, the returned
+    frame has their names.
+    """
+    state = load_state(state_file) or {}
+    resume = (
+        not full
+        and "done" in state
+        and os.path.isdir(store_path)
+        and os.path.isdir(arrays_path)
+        and os.path.exists(rollup_path)
     )
-    g.set(yscale="log")
-    g.set(title="Ping")
-    plt.legend([], [], frameon=False)
-    plt.savefig("ping.png")
+    done = state["done"] if resume else []
+    known = state.get("files", {})
+    files = log_files(log_file, known)
+    if not resume:
+        # the hourly cells of the compacted days have no raw pings left
+        # to be rebuilt from
+        empty = read_log_from(os.devnull)[0]
+        store.write_pings(empty, store_path)
+        store.write_arrays(empty, arrays_path)
+        rollup.write_rollup(
+            empty,
+            rollup_path,
+            keep_before=tiers.load_retention(retention_path)["raw_since"],
+        )
+
+    frames = []
+    bad_times = 0
+    live = None
+    for file_name, first, last, length in files:
+        newest = file_name == files[-1][0]
+        if [first, last, length] in done:
+            metrics.count("skipped_logs")
+            continue
+        stat = os.stat(file_name)
+        start = 0
+        if resume and not logfiles.is_compressed(file_name):
+            start = resume_offset(state, stat, first)
+        # only the newest file may still be written to
+        df, end = read_log_from(file_name, start, partial=not newest)
+        df, bad = fix_times(df)
+        bad_times += bad
+        coded = store.encode_targets(df, targets_path)
+        new = ~tiers.compacted(coded, retention_path)
+        if start == 0 and resume:
+            new &= ~store.stored(coded, arrays_path)
+        df, coded = df[new], coded[new]
+        if len(df):
+            store.append_pings(coded, store_path)
+            store.append_arrays(coded, arrays_path)
+            rollup.update_rollup(coded, rollup_path)
+            frames.append(df)
+            metrics.count("ingested_pings", len(df))
+        if not newest:
+            done.append([first, last, length])
+        elif not logfiles.is_compressed(file_name):
+            live = resume_state(stat, end, first)
+
+    if frames or not resume:
+        store.bump_version(version_path)
+
+    if live is None:
+        live = {k: state.get(k) for k in ("inode", "offset", "size", "first")}
+    present = [[first, last, length] for _, first, last, length in files]
+    save_state(
+        state_file,
+        {
+            "done": [d for d in done if d in present],
+            "files": {f[0]: known[f[0]] for f in files},
+            **live,
+        },
+    )
+    if not frames:
+        return read_log_from(os.devnull)[0], bad_times
+    return pd.concat(frames, ignore_index=True), bad_times
+
+
+def plot_log_to_file(df, target=store.DEFAULT_TARGET):
+    """
+    Draw the pings of target (a name) to ping.png as a density image,
+    whatever their number
+    """
+    if "target" in df:
+        df = df[df["target"] == target]
+    times = pd.to_datetime(df["time"]).to_numpy("datetime64[ns]")
+    density = report.Density(times.view(np.int64), df["delay"].to_numpy())
+    report.write_png(density, "ping.png")
 
 
 if __name__ == "__main__":
-    df = read_log("pinger.log")
-    df, bad_times = fix_times(df)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="parse only the lines appended since the last run",
+    )
+    parser.add_argument(
+        "--csv",
+        action="store_true",
+        help="also export the whole store to pings.csv",
+    )
+    parser.add_argument("--no-plot", action="store_true")
+    parser.add_argument(
+        "--metrics", metavar="FILE", help="write the timings as JSON to FILE"
+    )
+    args = parser.parse_args()
+
+    df, bad_times = ingest(
+        "pinger.log",
+        store.STORE_PATH,
+        "pings.state.json",
+        full=not args.incremental,
+    )
+    print(f"New pings: {len(df)}")
     print(f"Number of bad times: {bad_times}")
-    # write data to csv file
-    df.to_csv("pings.csv")
-    plot_log_to_file(df)
+    if args.incremental and (args.csv or not args.no_plot):
+        df = store.read_pings(columns=("time", "target", "delay", "status"))
+        names = np.asarray(store.load_targets(), dtype=object)
+        df["target"] = names[df["target"].to_numpy()]
+    if args.csv:
+        df.to_csv("pings.csv")
+    if not args.no_plot:
+        plot_log_to_file(df)
+    if args.metrics:
+        metrics.dump(args.metrics)
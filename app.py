@@ -1,19 +1,94 @@
+import functools
+import os
+import time
+
+import flask
 import pandas as pd
-import plotly.express as px
-from dash import Dash, Input, Output, dcc, html
+from dash import Dash, Input, Output, State, ctx, dcc, html, no_update
+from dash.exceptions import PreventUpdate
+
+import metrics
+from downsample import minmax
+from figcache import FigureCache
+from live import LiveData
+
+# sorted epoch-ns times and float32 delays of every target, memory-mapped
+# from pings.bin so all the worker processes share them through the page
+# cache, with their TimeIndex, the hourly rollups for the medians and the
+# data version
+data = LiveData()
+
+# seconds between two looks for new pings, 0 turns live mode off
+LIVE_INTERVAL = int(os.environ.get("PING_LIVE_INTERVAL", 0))
+if LIVE_INTERVAL:
+    data.follow(LIVE_INTERVAL)
+
+# figures computed for recent date ranges, shared between the workers
+# when PING_CACHE_DIR points at a directory (needs diskcache)
+cache = FigureCache(maxsize=64, directory=os.environ.get("PING_CACHE_DIR"))
+
+# most pings sent to the browser for the "Ping delays" scatter, shared by
+# the selected targets, when the range holds more they are downsampled,
+# timeouts are always all sent
+MAX_POINTS = 4000
+
+
+def selected(targets):
+    """
+    The codes of the selected targets that have pings, target 0 when
+    none is selected
+    """
+    targets = [t for t in targets or [] if t in data.indexes]
+    return targets or [0]
+
+
+def target_name(target):
+    return data.targets[target] if target < len(data.targets) else str(target)
+
 
-data = pd.read_csv("pings.csv")
+def instrumented(f):
+    """
+    Time every call of a callback as its "total" phase. The rest of its
+    request, the time Dash takes to decode the inputs and serialize the
+    figures, is timed as its "serialize" phase by time_request.
+    """
 
-# Convert the time column to datetime
-data["time"] = pd.to_datetime(data["time"])
+    @functools.wraps(f)
+    def wrapper(*args):
+        start = time.perf_counter_ns()
+        try:
+            return f(*args)
+        finally:
+            seconds = (time.perf_counter_ns() - start) / 1e9
+            metrics.observe(
+                "dash_callback", seconds, callback=f.__name__, phase="total"
+            )
+            if flask.has_request_context():
+                flask.g.callback = f.__name__
+                flask.g.callback_seconds = seconds
 
-# consider only data from 7am to 23pm
-data = data[(data["time"].dt.hour >= 7) & (data["time"].dt.hour <= 23)]
-# do not consider data from Saturday
-data = data[data["time"].dt.dayofweek != 5]
+    return wrapper
+
+
+def shown(pings):
+    """
+    Keep only the pings the dashboard looks at
+    """
+    # consider only data from 7am to 23pm
+    pings = pings[(pings["time"].dt.hour >= 7) & (pings["time"].dt.hour <= 23)]
+    # do not consider data from Saturday
+    pings = pings[pings["time"].dt.dayofweek != 5]
+
+    return pings
+
+
+def shown_cells(cells):
+    """
+    Keep only the rollup cells of the hours the dashboard looks at
+    """
+    hour = cells.hour_of_day
+    return cells.where((hour >= 7) & (hour <= 23) & (cells.dayofweek != 5))
 
-bad_pings = data[data["delay"] == float("inf")]
-good_pings = data[data["delay"] != float("inf")]
 
 external_stylesheets = [
     {
@@ -27,6 +102,37 @@ external_stylesheets = [
 app = Dash(__name__, external_stylesheets=external_stylesheets)
 app.title = "Ping statistics"
 
+
+@app.server.before_request
+def start_request():
+    flask.g.started = time.perf_counter_ns()
+
+
+@app.server.after_request
+def time_request(response):
+    callback = flask.g.get("callback")
+    if callback is not None and "started" in flask.g:
+        seconds = (time.perf_counter_ns() - flask.g.started) / 1e9
+        metrics.observe(
+            "dash_callback",
+            max(seconds - flask.g.callback_seconds, 0.0),
+            callback=callback,
+            phase="serialize",
+        )
+        metrics.count(
+            "dash_response_bytes",
+            response.content_length or 0,
+            callback=callback,
+        )
+    return response
+
+
+# the metrics of this worker process, in the Prometheus text format
+@app.server.route("/metrics")
+def serve_metrics():
+    return flask.Response(metrics.prometheus_text(), content_type=metrics.CONTENT_TYPE)
+
+
 # Create a header container
 header_container = html.Div(
     [
@@ -44,73 +150,61 @@ header_container = html.Div(
 )
 
 
-# Define callback to update the graphs based on the selected date range
-@app.callback(
-    [
-        Output("ping-delays", "figure"),
-        Output("median-delay-per-hour", "figure"),
-        Output("median-delay-per-day-hour", "figure"),
-    ],
-    Input("date-range", "start_date"),
-    Input("date-range", "end_date"),
-)
-def update_graphs(start_date, end_date):
-    filtered_data = data.loc[(data["time"] >= start_date) & (data["time"] <= end_date)]
-
-    # keep only the "good" pings
-    filtered_good_data = filtered_data[filtered_data["delay"] != float("inf")]
-
-    # filter out Friday and Saturday from the data
-    # filtered_data = filtered_data[
-    #     (filtered_data["time"].dt.dayofweek <= 3)
-    #     | (filtered_data["time"].dt.dayofweek == 6)
-    # ]
-
-    # Update figures using the filtered data
+def ping_delays(
+    start_date, end_date, targets=(0,), uirevision=None, callback="ping_delays"
+):
+    """
+    The "Ping delays" figure for the pings of the targets between
+    start_date and end_date, a trace of good pings and one of timeouts
+    per target, timed as the filter and aggregate phases of callback
+    """
+    traces = []
+    budget = MAX_POINTS // len(targets)
+    for target in targets:
+        with metrics.timer("dash_callback", callback=callback, phase="filter"):
+            # the "good" pings and the timeouts in range, from the
+            # coarsest tier that still has a point per time bucket
+            good_data, bad_data = data.points(
+                target, start_date, end_date, max(budget // 2, 1)
+            )
+            good_data = shown(good_data)
+            bad_data = shown(bad_data)
 
-    # Calculate the median delay per hour
-    median_delay_per_hour = (
-        filtered_good_data.groupby(filtered_good_data["time"].dt.hour)["delay"]
-        .median()
-        .reset_index()
-    )
+        with metrics.timer("dash_callback", callback=callback, phase="aggregate"):
+            # keep the fastest and slowest ping of every time bucket
+            keep = minmax(
+                good_data["time"].to_numpy().view("int64"),
+                good_data["delay"].to_numpy(),
+                budget,
+            )
+            good_data = good_data.iloc[keep]
 
-    # Calculate the median delay per day of the week and hour of the day
-    median_delay_per_day_hour = (
-        filtered_good_data.groupby(
-            [
-                filtered_good_data["time"].dt.dayofweek,
-                filtered_good_data["time"].dt.hour,
-            ]
-        )["delay"]
-        .median()
-        .reset_index(level=0)
-        .rename(columns={"time": "dayofweek"})
-        .reset_index()
-        .rename(columns={"time": "hour"})
-    )
-
-    ping_delays_figure = {
-        "data": [
+        name = target_name(target)
+        traces += [
             {
-                "x": filtered_data[filtered_data["delay"] != float("inf")]["time"],
-                "y": filtered_data[filtered_data["delay"] != float("inf")]["delay"],
+                "x": good_data["time"],
+                "y": good_data["delay"],
                 "type": "scatter",
                 "mode": "markers",
-                "name": "Good pings",
+                "name": name,
+                "legendgroup": name,
             },
             {
-                "x": filtered_data[filtered_data["delay"] == float("inf")]["time"],
-                "y": [5] * len(filtered_data[filtered_data["delay"] == float("inf")]),
+                "x": bad_data["time"],
+                "y": [5] * len(bad_data),
                 "type": "scatter",
                 "mode": "markers",
-                "name": "Bad pings",
+                "name": f"{name} timeouts",
+                "legendgroup": name,
                 "marker": {
                     "color": "red",
                     "symbol": "x",
                 },
             },
-        ],
+        ]
+
+    return {
+        "data": traces,
         "layout": {
             "xaxis": {
                 "title": "Time",
@@ -119,16 +213,91 @@ def update_graphs(start_date, end_date):
                 "title": "Ping delay (log scale)",
                 "type": "log",
             },
+            # keep the user's zoom while the date range stays the same
+            "uirevision": uirevision,
         },
     }
 
+
+def zoom_window(relayout_data):
+    """
+    The x range the user zoomed the scatter to, None when zoomed out and
+    False when the event is not about the x axis
+    """
+    if not relayout_data:
+        return False
+    if relayout_data.get("xaxis.autorange"):
+        return None
+    if "xaxis.range[0]" in relayout_data:
+        return relayout_data["xaxis.range[0]"], relayout_data["xaxis.range[1]"]
+    if "xaxis.range" in relayout_data:
+        return tuple(relayout_data["xaxis.range"])
+    return False
+
+
+# Define callback to update the graphs based on the selected date range
+@app.callback(
+    [
+        Output("ping-delays", "figure"),
+        Output("median-delay-per-hour", "figure"),
+        Output("median-delay-per-day-hour", "figure"),
+    ],
+    Input("date-range", "start_date"),
+    Input("date-range", "end_date"),
+    Input("targets", "value"),
+)
+@instrumented
+@cache.memoize(lambda: data.version)
+def update_graphs(start_date, end_date, targets=(0,)):
+    targets = selected(targets)
+    ping_delays_figure = ping_delays(
+        start_date,
+        end_date,
+        targets,
+        uirevision=f"{start_date}/{end_date}",
+        callback="update_graphs",
+    )
+
+    with metrics.timer(
+        "dash_callback", callback="update_graphs", phase="rollup_filter"
+    ):
+        # the medians of all the selected targets together
+        filtered_cells = shown_cells(
+            data.merged_cells(targets).select(start_date, end_date)
+        )
+        target_cells = {
+            target: shown_cells(data.rollups[target].select(start_date, end_date))
+            for target in targets
+        }
+
+    # filter out Friday and Saturday from the data
+    # filtered_cells = filtered_cells.where(
+    #     (filtered_cells.dayofweek <= 3) | (filtered_cells.dayofweek == 6)
+    # )
+
+    # Update figures using the filtered data
+
+    with metrics.timer(
+        "dash_callback", callback="update_graphs", phase="rollup_aggregate"
+    ):
+        # Median delay per hour of every target, merged from its hourly
+        # rollup cells
+        median_delay_per_hour = {
+            target: cells.summarize(["hour"]) for target, cells in target_cells.items()
+        }
+
+        # Median delay per day of the week and hour of the day
+        median_delay_per_day_hour = filtered_cells.summarize(["dayofweek", "hour"])
+
     median_delay_per_hour_figure = {
         "data": [
             {
-                "x": median_delay_per_hour["time"],
-                "y": median_delay_per_hour["delay"],
+                "x": medians["hour"],
+                "y": medians["delay"],
                 "type": "bar",
-            },
+                "name": target_name(target),
+            }
+            for target, medians in median_delay_per_hour.items()
         ],
         "layout": {
             "xaxis": {
@@ -194,62 +363,173 @@ def update_graphs(start_date, end_date):
     return figures
 
 
-app.layout = html.Div(
-    [
-        # Use the header_container here
-        header_container,
-        html.Div(
-            [
-                dcc.DatePickerRange(
-                    id="date-range",
-                    display_format="YYYY-MM-DD",
-                    start_date=data["time"].min(),
-                    end_date=data["time"].max(),
-                    className="daterangepicker",
-                ),
-            ],
-            className="date-range-container",
-        ),
-        html.Div(
-            [
-                html.Div(
-                    [
-                        html.H2(children="Ping delays", className="card-title"),
-                        dcc.Graph(
-                            id="ping-delays",
-                            figure={},
-                        ),
-                    ],
-                    className="card",
-                ),
-                html.Div(
-                    [
-                        html.H2("Median delay per hour", className="card-title"),
-                        dcc.Graph(
-                            id="median-delay-per-hour",
-                            figure={},
-                        ),
-                    ],
-                    className="card",
-                ),
-                html.Div(
-                    [
-                        html.H2(
-                            "Median delay: " "per day of the week and hour of the day",
-                            className="card-title",
-                        ),
-                        dcc.Graph(
-                            id="median-delay-per-day-hour",
-                            figure={},
-                        ),
-                    ],
-                    className="card",
-                ),
-            ],
-            className="graphs-container",
-        ),
-    ]
+# Re-sample the scatter for the window the user zoomed to, once the
+# window is small enough it is drawn in full resolution
+@app.callback(
+    Output("ping-delays", "figure", allow_duplicate=True),
+    Input("ping-delays", "relayoutData"),
+    State("date-range", "start_date"),
+    State("date-range", "end_date"),
+    State("targets", "value"),
+    prevent_initial_call=True,
 )
+@instrumented
+def zoom_ping_delays(relayout_data, start_date, end_date, targets=(0,)):
+    window = zoom_window(relayout_data)
+    if window is False:
+        raise PreventUpdate
+    uirevision = f"{start_date}/{end_date}"
+    if window is not None:
+        start_date = max(pd.Timestamp(start_date), pd.Timestamp(window[0]))
+        end_date = min(pd.Timestamp(end_date), pd.Timestamp(window[1]))
+    return ping_delays(
+        start_date,
+        end_date,
+        selected(targets),
+        uirevision=uirevision,
+        callback="zoom_ping_delays",
+    )
+
+
+# Send the browser only the pings that arrived since the last tick
+@app.callback(
+    Output("ping-delays", "extendData"),
+    Output("live-cursor", "data"),
+    Input("live-interval", "n_intervals"),
+    Input("date-range", "start_date"),
+    Input("date-range", "end_date"),
+    Input("targets", "value"),
+    State("live-cursor", "data"),
+    prevent_initial_call=True,
+)
+@instrumented
+def extend_ping_delays(n_intervals, start_date, end_date, targets, cursor):
+    targets = selected(targets)
+    # the time of the last ping of every target, keys are strings in JSON
+    last = {
+        str(target): int(data.indexes[target].times[-1])
+        for target in targets
+        if len(data.indexes[target])
+    }
+    if not last:
+        raise PreventUpdate
+    # a new date range or new targets redraw the whole figure, start
+    # following from here
+    if ctx.triggered_id in ("date-range", "targets") or not cursor:
+        return no_update, last
+    if all(last[t] <= cursor.get(t, last[t]) for t in last):
+        raise PreventUpdate
+    start = pd.Timestamp(min(cursor.get(t, last[t]) for t in last) + 1)
+    # the user is looking at the past, nothing to add
+    if end_date is not None and pd.Timestamp(end_date) < start.normalize():
+        return no_update, last
+
+    extension = {"x": [], "y": []}
+    for target in targets:
+        index = data.indexes[target]
+        key = str(target)
+        if key in last and key in cursor:
+            new = (pd.Timestamp(cursor[key] + 1), pd.Timestamp(last[key]))
+        else:
+            # nothing to add, an empty range
+            new = (pd.Timestamp(1), pd.Timestamp(0))
+        with metrics.timer(
+            "dash_callback", callback="extend_ping_delays", phase="filter"
+        ):
+            good_data = shown(index.good(*new))
+            bad_data = shown(index.timeouts(*new))
+        extension["x"] += [good_data["time"], bad_data["time"]]
+        extension["y"] += [good_data["delay"], [5] * len(bad_data)]
+    return (extension, list(range(2 * len(targets)))), last
+
+
+def serve_layout():
+    index = data.index
+    # the hourly rollup goes back further than the raw pings
+    first = pd.Timestamp(data.first()) if data.first() is not None else None
+    last = pd.Timestamp(index.times[-1]) if len(index) else None
+    targets = [
+        {"label": name, "value": target}
+        for target, name in enumerate(data.targets)
+        if target in data.indexes
+    ]
+    return html.Div(
+        [
+            # Use the header_container here
+            header_container,
+            html.Div(
+                [
+                    dcc.DatePickerRange(
+                        id="date-range",
+                        display_format="YYYY-MM-DD",
+                        start_date=first,
+                        end_date=last,
+                        className="daterangepicker",
+                    ),
+                    dcc.Dropdown(
+                        id="targets",
+                        options=targets,
+                        value=[0],
+                        multi=True,
+                        clearable=False,
+                        className="target-dropdown",
+                    ),
+                ],
+                className="date-range-container",
+            ),
+            dcc.Interval(
+                id="live-interval",
+                interval=max(LIVE_INTERVAL, 1) * 1000,
+                disabled=not LIVE_INTERVAL,
+            ),
+            dcc.Store(
+                id="live-cursor",
+                data={"0": last.value} if last is not None else None,
+            ),
+            html.Div(
+                [
+                    html.Div(
+                        [
+                            html.H2(children="Ping delays", className="card-title"),
+                            dcc.Graph(
+                                id="ping-delays",
+                                figure={},
+                            ),
+                        ],
+                        className="card",
+                    ),
+                    html.Div(
+                        [
+                            html.H2("Median delay per hour", className="card-title"),
+                            dcc.Graph(
+                                id="median-delay-per-hour",
+                                figure={},
+                            ),
+                        ],
+                        className="card",
+                    ),
+                    html.Div(
+                        [
+                            html.H2(
+                                "Median delay: "
+                                "per day of the week and hour of the day",
+                                className="card-title",
+                            ),
+                            dcc.Graph(
+                                id="median-delay-per-day-hour",
+                                figure={},
+                            ),
+                        ],
+                        className="card",
+                    ),
+                ],
+                className="graphs-container",
+            ),
+        ]
+    )
+
+
+app.layout = serve_layout
 
 if __name__ == "__main__":
-    app.run_server()
+    app.run()
@@ -0,0 +1,142 @@
+"""
+Parallel backfill of large log archives
+
+    python backfill.py pinger.log old/*.log [--workers N] [--chunk-size MB]
+
+Every file is cut into chunks of about --chunk-size, at the start of a
+record (for pinger.sh logs, the date line in front of a PING header), so
+no record is split between two chunks. The chunks are parsed by the
+dialect parsers of dialects.py in a ProcessPoolExecutor, and the
+results, each already sorted, are merged and written to the ping store.
+Pings the store already has (same target and time) are skipped, so
+backfilling the same logs again, or logs ingest already read, adds
+nothing. --replace replaces the store instead.
+"""
+
+import argparse
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import store
+import tiers
+from dialects import DIALECTS, detect
+
+CHUNK_SIZE = 32 << 20
+
+# how far to read past a cut to find the start of the next record
+WINDOW = 64 << 10
+
+
+def record_start(name):
+    """
+    The compiled (bytes) pattern of the start of a record of a dialect
+    """
+    pattern, _ = DIALECTS[name]
+    return re.compile(pattern.pattern.encode(), re.M)
+
+
+def split_points(file_name, start_pattern, chunk_size=CHUNK_SIZE):
+    """
+    Offsets that cut file_name into chunks of about chunk_size bytes, each
+    starting at the start of a record
+    """
+    size = os.path.getsize(file_name)
+    points = [0]
+    with open(file_name, "rb") as f:
+        for cut in range(chunk_size, size, chunk_size):
+            if cut <= points[-1]:
+                continue
+            offset = cut
+            while True:
+                f.seek(offset)
+                window = f.read(WINDOW)
+                # skip the rest of the line the cut fell in
+                line_end = window.find(b"\n")
+                match = None
+                if line_end >= 0:
+                    match = start_pattern.search(window, line_end + 1)
+                if match:
+                    points.append(offset + match.start())
+                    break
+                if len(window) < WINDOW:
+                    # no record starts after the cut
+                    break
+                # overlap the windows by a line or so
+                offset += WINDOW - 256
+    points.append(size)
+    return sorted(set(points))
+
+
+def parse_chunk(file_name, start, end, dialect, target=None):
+    """
+    Parse bytes [start, end) of a log
+    """
+    with open(file_name, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode(errors="replace")
+    _, parse_text = DIALECTS[dialect]
+    return parse_text(text, target)
+
+
+def backfill(file_names, workers=None, chunk_size=CHUNK_SIZE, target=None):
+    """
+    Parse all the files in parallel, returns their pings sorted by time
+    """
+    jobs = []
+    for file_name in file_names:
+        dialect = detect(file_name)
+        points = split_points(file_name, record_start(dialect), chunk_size)
+        for start, end in zip(points[:-1], points[1:]):
+            jobs.append((file_name, start, end, dialect, target))
+
+    with ProcessPoolExecutor(workers) as pool:
+        parts = list(pool.map(parse_chunk, *zip(*jobs))) if jobs else []
+
+    if not parts:
+        return pd.DataFrame(
+            {
+                "time": pd.Series(dtype="datetime64[ns]"),
+                "target": [],
+                "delay": [],
+            }
+        )
+    # every part is sorted, a stable merge sort of the runs is close to
+    # linear
+    df = pd.concat(parts, ignore_index=True)
+    return df.sort_values("time", kind="mergesort", ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--chunk-size", type=int, default=CHUNK_SIZE >> 20, help="MB"
+    )
+    parser.add_argument("--target", default=None)
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="replace the ping store instead of adding to it",
+    )
+    args = parser.parse_args()
+
+    size = sum(os.path.getsize(log) for log in args.logs)
+    start = time.perf_counter()
+    df = backfill(args.logs, args.workers, args.chunk_size << 20, args.target)
+    elapsed = time.perf_counter() - start
+    print(
+        f"Parsed {len(df)} pings from {size / 2**20:.1f} MB in {elapsed:.2f}s"
+        f" ({len(df) / elapsed:,.0f} records/s,"
+        f" {args.workers or os.cpu_count()} workers)"
+    )
+
+    if args.replace:
+        store.replace_pings(df[["time", "target", "delay"]])
+    else:
+        added = tiers.add_new_pings(df[["time", "target", "delay"]])
+        print(f"Added {added} new pings")
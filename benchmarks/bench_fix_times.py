@@ -0,0 +1,63 @@
+"""
+Compare the row-by-row and the vectorized modes of analysis.fix_times
+
+    python benchmarks/bench_fix_times.py [--sizes 10000 ... ] [--loop-max N]
+
+The row-by-row mode is only timed up to --loop-max rows, above that it
+takes minutes and the numbers are not interesting anymore.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analysis import TIME_FORMAT, fix_times  # noqa: E402
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+
+def make_frame(n, bad_rate=0.001, seed=0):
+    """
+    n rows of read_log output, 5 minutes apart, with some corrupt times
+    """
+    rng = np.random.default_rng(seed)
+    times = pd.date_range("2023-01-01", periods=n, freq="5min").strftime(
+        TIME_FORMAT
+    )
+    times = np.asarray(times, dtype=object)
+    bad = rng.random(n) < bad_rate
+    times[bad] = "Tue Jun 20 08:55:01"
+    delays = rng.lognormal(3, 0.5, n)
+    return pd.DataFrame({"time": times, "delay": delays})
+
+
+def timeit(df, vectorized):
+    start = time.perf_counter()
+    _, bad_times = fix_times(df.copy(), vectorized=vectorized)
+    return time.perf_counter() - start, bad_times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--loop-max", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'loop (s)':>10} {'vector (s)':>11} {'rows/s':>12}")
+    for n in args.sizes:
+        df = make_frame(n)
+        vector_time, vector_bad = timeit(df, vectorized=True)
+        loop = "-"
+        if n <= args.loop_max:
+            loop_time, loop_bad = timeit(df, vectorized=False)
+            assert loop_bad == vector_bad
+            loop = f"{loop_time:.3f}"
+        print(
+            f"{n:>10} {loop:>10} {vector_time:>11.3f} {n / vector_time:>12,.0f}"
+        )
@@ -0,0 +1,326 @@
+"""
+Time every stage of the pipeline on synthetic logs
+
+    python benchmarks/bench_pipeline.py [--sizes 10000 ... ] [--stages ...]
+        [--out results.json] [--compare old.json] [--tolerance 1.25]
+
+For every size a pinger.sh log and the archive logs are generated (see
+synthetic.py) in a scratch directory, then every stage runs in its own
+python process, so its peak RSS is its own:
+
+    read_log       analysis.read_log of the pinger.sh log
+    fix_times      analysis.fix_times of its output
+    csv            the pings.csv export and read back
+    ingest         analysis.ingest of the whole log into the stores
+    read_store     store.read_pings of everything
+    archive        dialects.read_any of the lag, prefixed and loss logs
+    rollup         the per-hour and per-weekday medians of ploting.py
+    report         report.Density of the array store, and ping.png
+    update_graphs  the dashboard figures of the whole range, uncached
+
+The results (seconds, samples/s and peak RSS of every stage and size,
+with the commit and the machine) are written as JSON to --out. With
+--compare the run is checked against an earlier result file and the
+exit status is 1 when a stage got slower than --tolerance times its
+earlier time. A 1e7 sample pinger.sh log takes about 2.5 GB of disk.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import synthetic  # noqa: E402
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+ARCHIVE_DIALECTS = ["lag", "prefixed", "loss"]
+
+STAGES = {}
+
+
+def stage(f):
+    """
+    Register f(n) as a stage. It runs in the scratch directory of its
+    size, does its setup, and returns the function to time.
+    """
+    STAGES[f.__name__] = f
+    return f
+
+
+def quiet(f, *args):
+    # read_log prints every bad reply line
+    with contextlib.redirect_stdout(io.StringIO()):
+        return f(*args)
+
+
+def stores():
+    """
+    Ingest the log when an earlier stage has not
+    """
+    import store
+    from analysis import ingest
+
+    if not os.path.isdir(store.ARRAYS_PATH):
+        quiet(ingest, "pinger.log", store.STORE_PATH, "pings.state.json", True)
+
+
+@stage
+def read_log(n):
+    from analysis import read_log
+
+    return lambda: quiet(read_log, "pinger.log")
+
+
+@stage
+def fix_times(n):
+    from analysis import fix_times, read_log
+
+    df = quiet(read_log, "pinger.log")
+    return lambda: fix_times(df)
+
+
+@stage
+def csv(n):
+    import pandas as pd
+
+    from analysis import fix_times, read_log
+
+    df, _ = fix_times(quiet(read_log, "pinger.log"))
+
+    def run():
+        df.to_csv("pings.csv")
+        pd.read_csv(
+            "pings.csv", usecols=["time", "delay"], parse_dates=["time"]
+        )
+
+    return run
+
+
+@stage
+def ingest(n):
+    import store
+    from analysis import ingest
+
+    return lambda: quiet(
+        ingest, "pinger.log", store.STORE_PATH, "pings.state.json", True
+    )
+
+
+@stage
+def read_store(n):
+    import store
+
+    stores()
+    return lambda: store.read_pings()
+
+
+@stage
+def archive(n):
+    from dialects import read_any
+
+    def run():
+        for dialect in ARCHIVE_DIALECTS:
+            read_any(f"{dialect}.log", dialect)
+
+    return run
+
+
+@stage
+def rollup(n):
+    import numpy as np
+
+    from rollup import Rollup
+
+    stores()
+
+    def run():
+        cells = Rollup.load()
+        cells.summarize(["hour"])
+        cells.where(~np.isin(cells.dayofweek, [4, 5])).summarize(
+            ["dayofweek", "hour"]
+        )
+
+    return run
+
+
+@stage
+def report(n):
+    import report
+
+    stores()
+
+    def run():
+        times, delays, _ = report.load()
+        report.write_png(report.Density(times, delays), "ping.png")
+
+    return run
+
+
+@stage
+def update_graphs(n):
+    # the dashboard loads the stores when it is imported
+    stores()
+    import app
+
+    start = app.data.index.times[0].view("datetime64[ns]")
+    end = app.data.index.times[-1].view("datetime64[ns]")
+    # time the figures, not the cache
+    update = getattr(app.update_graphs, "__wrapped__", app.update_graphs)
+    return lambda: update(str(start), str(end))
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def run_stage(name, n, result_file):
+    """
+    Run one stage in this process (the child side)
+    """
+    run = STAGES[name](n)
+    setup_rss = peak_rss_mb()
+    start = time.perf_counter()
+    run()
+    seconds = time.perf_counter() - start
+    with open(result_file, "w") as f:
+        json.dump(
+            {
+                "seconds": seconds,
+                "peak_rss_mb": peak_rss_mb(),
+                "setup_rss_mb": setup_rss,
+            },
+            f,
+        )
+
+
+def generate(directory, n, seed=0):
+    """
+    Write the synthetic logs of n samples to directory, returns seconds
+    """
+    start = time.perf_counter()
+    synthetic.write_log(os.path.join(directory, "pinger.log"), n, seed=seed)
+    for dialect in ARCHIVE_DIALECTS:
+        synthetic.write_log(
+            os.path.join(directory, f"{dialect}.log"), n, dialect, seed=seed
+        )
+    return time.perf_counter() - start
+
+
+def measure(name, n, directory):
+    result_file = os.path.join(directory, f"{name}.json")
+    subprocess.run(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--run-stage",
+            name,
+            "--size",
+            str(n),
+            "--result",
+            result_file,
+        ],
+        cwd=directory,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    with open(result_file, "r") as f:
+        return json.load(f)
+
+
+def machine():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results, old_results, tolerance):
+    """
+    The (stage, samples, old, new seconds) that got slower than
+    tolerance times their old time
+    """
+    old = {(r["stage"], r["samples"]): r["seconds"] for r in old_results}
+    slower = []
+    for r in results:
+        before = old.get((r["stage"], r["samples"]))
+        if before and r["seconds"] > tolerance * before:
+            slower.append((r["stage"], r["samples"], before, r["seconds"]))
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument(
+        "--stages", nargs="+", choices=STAGES, default=list(STAGES)
+    )
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", metavar="OLD_JSON", default=None)
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    parser.add_argument("--keep", action="store_true", help="keep the logs")
+    parser.add_argument("--run-stage", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        run_stage(args.run_stage, args.size, args.result)
+        sys.exit(0)
+
+    results = []
+    print(f"{'stage':14} {'samples':>10} {'s':>9} {'samples/s':>12} {'MB':>7}")
+    for n in args.sizes:
+        directory = tempfile.mkdtemp(prefix=f"bench-{n}-")
+        try:
+            seconds = generate(directory, n)
+            print(f"{'(generate)':14} {n:>10} {seconds:>9.3f}")
+            for name in args.stages:
+                r = measure(name, n, directory)
+                r.update(stage=name, samples=n, samples_per_s=n / r["seconds"])
+                results.append(r)
+                print(
+                    f"{name:14} {n:>10} {r['seconds']:>9.3f}"
+                    f" {r['samples_per_s']:>12,.0f} {r['peak_rss_mb']:>7.0f}"
+                )
+        finally:
+            if args.keep:
+                print(f"logs kept in {directory}")
+            else:
+                shutil.rmtree(directory)
+
+    with open(args.out, "w") as f:
+        json.dump({"machine": machine(), "results": results}, f, indent=1)
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            old_results = json.load(f)["results"]
+        slower = compare(results, old_results, args.tolerance)
+        for name, n, before, after in slower:
+            print(f"SLOWER {name} at {n}: {before:.3f}s -> {after:.3f}s")
+        sys.exit(1 if slower else 0)
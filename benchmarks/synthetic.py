@@ -0,0 +1,174 @@
+"""
+Deterministic synthetic ping logs
+
+    python benchmarks/synthetic.py out.log -n 100000 [--dialect pinger]
+        [--timeout-rate 0.02] [--corrupt-rate 0.001] [--seed 0]
+
+Writes n samples, one every --interval seconds from --start, in the
+format of pinger.sh (the default) or of one of the archive loggers (lag,
+prefixed, loss; see dialects.py). The same seed always gives the same
+file. A timeout-rate fraction of the pings is lost and a corrupt-rate
+fraction of the samples is garbled the way real logs were: a date line
+written in another format, or a reply line cut short.
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dialects import DIALECTS  # noqa: E402
+
+# samples formatted and written at once
+CHUNK = 100_000
+
+HOST = "8.8.8.8"
+
+# what `date` wrote when the locale was wrong
+BAD_DATE = "Tue Jun 20 08:55:01"
+
+
+def samples(n, timeout_rate=0.02, corrupt_rate=0.001, seed=0):
+    """
+    The delays (ms, inf when lost) and the corrupt flags of n samples
+    """
+    rng = np.random.default_rng(seed)
+    delays = rng.lognormal(3.3, 0.5, n)
+    delays[rng.random(n) < timeout_rate] = np.inf
+    corrupt = rng.random(n) < corrupt_rate
+    return delays, corrupt
+
+
+def pinger_block(date, delay, corrupt):
+    if corrupt and delay < np.inf:
+        # half of the corrupt samples have a bad date, half a cut reply
+        if int(delay * 1000) % 2:
+            date = BAD_DATE
+        else:
+            return (
+                f"{date}\nPING {HOST} ({HOST}): 56 data bytes\n64 bytes fr\n"
+            )
+    if delay == np.inf:
+        return (
+            f"{date}\nPING {HOST} ({HOST}): 56 data bytes\n\n"
+            f"--- {HOST} ping statistics ---\n"
+            "1 packets transmitted, 0 packets received, 100.0% packet loss\n"
+        )
+    return (
+        f"{date}\nPING {HOST} ({HOST}): 56 data bytes\n"
+        f"64 bytes from {HOST}: icmp_seq=0 ttl=117 time={delay:.3f} ms\n\n"
+        f"--- {HOST} ping statistics ---\n"
+        "1 packets transmitted, 1 packets received, 0.0% packet loss\n"
+        f"round-trip min/avg/max/stddev = {delay:.3f}/{delay:.3f}/"
+        f"{delay:.3f}/0.000 ms\n"
+    )
+
+
+def lag_block(date, delay, corrupt):
+    if corrupt:
+        return f"{date} - Lag: \n"
+    if delay == np.inf:
+        return f"{date} - Request timed out\n"
+    return f"{date} - Lag: {delay:.3f} ms\n"
+
+
+def prefixed_block(date, delay, corrupt):
+    received = int(delay < np.inf)
+    block = (
+        f"{date} PING {HOST} ({HOST}) 56(84) bytes of data.\n"
+        f"{date} --- {HOST} ping statistics ---\n"
+        f"{date} 1 packets transmitted, {received} received,"
+        f" {100 - 100 * received}% packet loss, time 0ms\n"
+    )
+    if received:
+        block += (
+            f"{date} rtt min/avg/max/mdev = {delay:.3f}/{delay:.3f}/"
+            f"{delay:.3f}/0.000 ms\n"
+        )
+    if corrupt:
+        block = block[: len(block) // 2] + "\n"
+    return block
+
+
+def loss_block(date, delay, corrupt):
+    if corrupt:
+        date = BAD_DATE
+    received = int(delay < np.inf)
+    return (
+        f"{date}\n1 packets transmitted, {received} packets received,"
+        f" {100 - 100 * received}.0% packet loss\n"
+    )
+
+
+FORMATS = {
+    "pinger": (pinger_block, "%m/%d/%y-%H:%M:%S"),
+    "lag": (lag_block, "%Y-%m-%d %H:%M:%S"),
+    "prefixed": (prefixed_block, "%Y-%m-%d %H:%M:%S"),
+    "loss": (loss_block, "%m/%d/%y-%H:%M:%S"),
+}
+
+assert set(FORMATS) <= set(DIALECTS)
+
+
+def write_log(
+    file_name,
+    n,
+    dialect="pinger",
+    timeout_rate=0.02,
+    corrupt_rate=0.001,
+    seed=0,
+    start="2023-01-01",
+    interval=60,
+):
+    """
+    Write a log of n samples, returns its size in bytes
+    """
+    block, time_format = FORMATS[dialect]
+    delays, corrupt = samples(n, timeout_rate, corrupt_rate, seed)
+    start = pd.Timestamp(start)
+    with open(file_name, "w") as f:
+        for lo in range(0, n, CHUNK):
+            hi = min(lo + CHUNK, n)
+            dates = (
+                start + pd.to_timedelta(np.arange(lo, hi) * interval, unit="s")
+            ).strftime(time_format)
+            f.write(
+                "".join(
+                    map(
+                        block,
+                        dates,
+                        delays[lo:hi].tolist(),
+                        corrupt[lo:hi].tolist(),
+                    )
+                )
+            )
+    return os.path.getsize(file_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file_name")
+    parser.add_argument("-n", type=int, default=100_000)
+    parser.add_argument("--dialect", choices=FORMATS, default="pinger")
+    parser.add_argument("--timeout-rate", type=float, default=0.02)
+    parser.add_argument("--corrupt-rate", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--start", default="2023-01-01")
+    parser.add_argument("--interval", type=float, default=60, help="s")
+    args = parser.parse_args()
+
+    size = write_log(
+        args.file_name,
+        args.n,
+        args.dialect,
+        args.timeout_rate,
+        args.corrupt_rate,
+        args.seed,
+        args.start,
+        args.interval,
+    )
+    print(f"Wrote {args.n} samples, {size / 2**20:.1f} MB")
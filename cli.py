@@ -0,0 +1,259 @@
+"""
+One entry point for the batch jobs and the dashboard
+
+    python cli.py ingest [--full] [--log pinger.log | GLOB]
+    python cli.py export [--out pings.csv] [--start DATE] [--end DATE]
+        [--target HOST ...]
+    python cli.py plot [--out ping.png] [--target HOST]
+    python cli.py report [--out DIR] [--target HOST]
+    python cli.py compact [--raw-days 30] [--minute-days 365]
+    python cli.py serve [--host HOST] [--port PORT]
+    python cli.py importtime [--budget MS]
+
+Only argparse is imported up front. Every subcommand imports the modules
+it needs when it runs, and the modules themselves import matplotlib,
+plotly and Dash only in the functions that draw or serve, so a cron job
+that ingests or exports never pays for them.
+
+importtime runs python -X importtime for the modules of every
+subcommand in a fresh interpreter, prints the total and the heaviest
+imports, and exits with 1 when a subcommand is over its budget or
+imports one of the plotting libraries it should not.
+
+--metrics FILE (before the subcommand) writes the timers and counters of
+the run (see metrics.py) as JSON to FILE when it is done.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# the modules every subcommand imports before it starts working
+COMMAND_MODULES = {
+    "ingest": ["analysis"],
+    "export": ["store"],
+    "plot": ["report"],
+    "report": ["report"],
+    "compact": ["tiers"],
+    "serve": ["app"],
+}
+
+# import time budgets in ms
+BUDGETS = {
+    "ingest": 1000,
+    "export": 1000,
+    "plot": 1000,
+    "report": 1000,
+    "compact": 1000,
+    "serve": 2500,
+}
+
+# imported only by the subcommands that draw or serve, at run time
+LAZY = ("matplotlib", "seaborn", "plotly", "dash")
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+def ingest(args):
+    import store
+    from analysis import ingest
+
+    df, bad_times = ingest(
+        args.log, store.STORE_PATH, args.state, full=args.full
+    )
+    print(f"New pings: {len(df)}")
+    print(f"Number of bad times: {bad_times}")
+
+
+def export(args):
+    import numpy as np
+
+    import store
+
+    targets = None
+    if args.target:
+        targets = [store.target_code(name) for name in args.target]
+    df = store.read_pings(
+        start=args.start,
+        end=args.end,
+        columns=("time", "target", "delay", "status"),
+        targets=targets,
+    )
+    names = np.asarray(store.load_targets(), dtype=object)
+    df["target"] = names[df["target"].to_numpy()]
+    df.to_csv(args.out)
+    print(args.out)
+
+
+def plot(args):
+    import report
+    import store
+
+    target = store.target_code(args.target)
+    times, delays, cells = report.load(target=target)
+    report.write_png(
+        report.tiered_density(times, delays, cells, target=target), args.out
+    )
+    print(args.out)
+
+
+def render_report(args):
+    import report
+    import store
+
+    for file_name in report.render(
+        args.out,
+        args.width,
+        args.height,
+        target=store.target_code(args.target),
+    ):
+        print(file_name)
+
+
+def compact(args):
+    import tiers
+
+    summarized, expired = tiers.compact(
+        args.root, args.raw_days, args.minute_days
+    )
+    print(f"Summarized raw days: {', '.join(summarized) or 'none'}")
+    print(f"Dropped minute days: {', '.join(expired) or 'none'}")
+
+
+def serve(args):
+    from app import app
+
+    app.run(host=args.host, port=args.port, debug=args.debug)
+
+
+def import_times(modules):
+    """
+    The total import time of modules in a fresh interpreter in ms, and
+    the cumulative ms of every package imported on the way
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            "; ".join(f"import {m}" for m in modules),
+        ],
+        # where the modules are
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    packages = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, name = match.groups()
+        ms = int(cumulative) / 1000
+        if not indent:
+            total += ms
+        if "." not in name:
+            packages[name] = max(packages.get(name, 0), ms)
+    return total, packages
+
+
+def check_import_times(args):
+    over = False
+    for command, modules in COMMAND_MODULES.items():
+        total, packages = import_times(modules)
+        budget = args.budget or BUDGETS[command]
+        lazy = [] if command == "serve" else sorted(set(packages) & set(LAZY))
+        status = "ok" if total <= budget and not lazy else "OVER"
+        over = over or status != "ok"
+        print(f"{command:8} {total:7.0f} ms  (budget {budget} ms)  {status}")
+        heaviest = sorted(
+            (item for item in packages.items() if item[0] not in modules),
+            key=lambda item: -item[1],
+        )[: args.top]
+        print("    " + ", ".join(f"{name} {ms:.0f}" for name, ms in heaviest))
+        if lazy:
+            print(f"    imports {', '.join(lazy)} at startup")
+    return 1 if over else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="write the timers and counters of the run as JSON to FILE",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("ingest", help="parse pinger.log into the stores")
+    p.add_argument(
+        "--log",
+        default="pinger.log",
+        help="a log and its rotations, or a glob",
+    )
+    p.add_argument("--state", default="pings.state.json")
+    p.add_argument(
+        "--full",
+        action="store_true",
+        help="parse the whole log again instead of only what was appended",
+    )
+    p.set_defaults(run=ingest)
+
+    p = commands.add_parser("export", help="write the pings to a CSV file")
+    p.add_argument("--out", default="pings.csv")
+    p.add_argument("--start", default=None)
+    p.add_argument("--end", default=None)
+    p.add_argument("--target", nargs="+", default=None, help="all by default")
+    p.set_defaults(run=export)
+
+    p = commands.add_parser("plot", help="draw the pings to a PNG")
+    p.add_argument("--out", default="ping.png")
+    p.add_argument("--target", default="8.8.8.8")
+    p.set_defaults(run=plot)
+
+    p = commands.add_parser("report", help="write the PNG and HTML report")
+    p.add_argument("--out", default=".")
+    p.add_argument("--width", type=int, default=1000)
+    p.add_argument("--height", type=int, default=250)
+    p.add_argument("--target", default="8.8.8.8")
+    p.set_defaults(run=render_report)
+
+    p = commands.add_parser(
+        "compact", help="summarize and drop the old raw and minute data"
+    )
+    p.add_argument("--root", default="")
+    p.add_argument("--raw-days", type=int, default=30)
+    p.add_argument("--minute-days", type=int, default=365)
+    p.set_defaults(run=compact)
+
+    p = commands.add_parser("serve", help="run the dashboard")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8050)
+    p.add_argument("--debug", action="store_true")
+    p.set_defaults(run=serve)
+
+    p = commands.add_parser(
+        "importtime", help="check the import time of every subcommand"
+    )
+    p.add_argument(
+        "--budget", type=float, default=None, help="ms, for all subcommands"
+    )
+    p.add_argument("--top", type=int, default=5)
+    p.set_defaults(run=check_import_times)
+
+    args = parser.parse_args(argv)
+    status = args.run(args)
+    if args.metrics:
+        import metrics
+
+        metrics.dump(args.metrics)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,360 @@
+"""
+Collect the pings of many nodes into one store
+
+    python collector.py serve [--root collected] [--port 8060] [--flush 5]
+    python collector.py push URL [--node NAME] [--log pinger.log]
+
+Every node (a machine that runs pinger.sh or prober.py) uploads batches
+of pings with POST /pings, as a JSON object
+
+    {"node": "laptop", "time": [epoch ns, ...], "target": [host, ...],
+     "delay": [ms, null when lost, ...], "status": [0, 1, 2, ...]}
+
+and the collector keeps the pings of node N to host H as target "N/H"
+of the store in --root, so the series of every node stay apart.
+
+Batches come in late and out of order (an agent that could not reach the
+collector sends its backlog when it can). Every batch is sorted once
+when it arrives, which makes it a sorted run, and every --flush seconds
+the runs are merged with a k-way merge into one. Pings already seen
+(same node, host and time, e.g. a batch sent again because its answer
+was lost) are dropped, and the rest is added to the store, where the
+arrays of every target are merged with the new pings in one pass.
+
+An agent keeps what it could not send and sends it with its next batch,
+retrying less and less often while the collector is down: prober.py
+--collector URL, or push, which uploads what was appended to a pinger.sh
+log since its last successful push (the log is its buffer).
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+import store
+import tiers
+from records import OK, status_codes
+
+COLLECTED_PATH = "collected"
+
+# most pings in one upload
+BATCH_SIZE = 50_000
+
+
+def to_batch(df, node):
+    """
+    The JSON object of the upload of the pings in df
+    """
+    delays = df["delay"].to_numpy(np.float64)
+    return {
+        "node": node,
+        "time": pd.to_datetime(df["time"])
+        .to_numpy("datetime64[ns]")
+        .view(np.int64)
+        .tolist(),
+        "target": df["target"].astype(str).tolist(),
+        # JSON has no inf and no NaN
+        "delay": np.where(np.isfinite(delays), delays, None).tolist(),
+        "status": status_codes(df).tolist(),
+    }
+
+
+def from_batch(batch):
+    """
+    The pings of an upload, sorted by time, with their targets named
+    node/host
+    """
+    status = np.asarray(batch["status"], dtype=np.uint8)
+    delays = np.asarray(batch["delay"], dtype=np.float64)
+    # a lost ping has no delay, an answer of unknown RTT neither
+    delays[np.isnan(delays) & (status != OK)] = np.inf
+    df = pd.DataFrame(
+        {
+            "time": np.asarray(batch["time"], dtype=np.int64).view(
+                "datetime64[ns]"
+            ),
+            "target": [f"{batch['node']}/{host}" for host in batch["target"]],
+            "delay": delays,
+            "status": status,
+        }
+    )
+    if not df["time"].is_monotonic_increasing:
+        df = df.sort_values("time", kind="stable", ignore_index=True)
+    return df
+
+
+def merge_runs(runs):
+    """
+    The pings of runs, frames sorted by time, merged into one frame sorted
+    by time with a k-way merge, without repeated (target, time) pings
+    """
+    runs = [run for run in runs if len(run)]
+    if not runs:
+        return pd.DataFrame(columns=["time", "target", "delay", "status"])
+    heads = [
+        zip(
+            run["time"].to_numpy().view(np.int64).tolist(),
+            itertools.repeat(i),
+            range(len(run)),
+        )
+        for i, run in enumerate(runs)
+    ]
+    starts = np.cumsum([0] + [len(run) for run in runs])
+    order = [starts[i] + j for _, i, j in heapq.merge(*heads)]
+    merged = pd.concat(runs, ignore_index=True).iloc[order]
+    return merged.drop_duplicates(["target", "time"], ignore_index=True)
+
+
+class Collector:
+    """
+    The sorted runs received since the last flush, and the store in root
+    they are flushed to
+    """
+
+    def __init__(self, root=COLLECTED_PATH):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.runs = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.received = 0
+        self.stored = 0
+
+    def receive(self, batch):
+        run = from_batch(batch)
+        with self.lock:
+            self.runs.append(run)
+            self.received += len(run)
+        return len(run)
+
+    def unseen(self, df):
+        """
+        The pings of df, with their targets as codes, that are not in the
+        store yet, nor compacted away from it
+        """
+        return tiers.unseen(df, self.root)
+
+    def flush(self):
+        """
+        Merge the runs received so far and add them to the store, returns
+        the number of new pings. When that fails the runs are put back,
+        the agents were told they were accepted.
+        """
+        with self.flush_lock:
+            with self.lock:
+                runs, self.runs = self.runs, []
+            if not runs:
+                return 0
+            try:
+                df = self.unseen(merge_runs(runs))
+                store.add_pings(df, self.root)
+            except BaseException:
+                with self.lock:
+                    self.runs[:0] = runs
+                raise
+            self.stored += len(df)
+            return len(df)
+
+    def follow(self, interval):
+        """
+        Flush every interval seconds in a daemon thread, a failed flush is
+        tried again the next time
+        """
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                except Exception as err:
+                    print(f"flush failed ({err!r}), retry in {interval:g}s")
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+def handler(collector):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/pings":
+                self.send_error(404)
+                return
+            try:
+                length = int(self.headers["Content-Length"])
+                accepted = collector.receive(
+                    json.loads(self.rfile.read(length))
+                )
+            except (TypeError, ValueError, KeyError) as err:
+                self.send_error(400, str(err))
+                return
+            body = json.dumps({"accepted": accepted}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def stand_in(root=COLLECTED_PATH, host="127.0.0.1", port=0):
+    """
+    Start a collector serving on host in a daemon thread, returns the
+    server, the collector and the URL to upload to
+    """
+    collector = Collector(root)
+    server = ThreadingHTTPServer((host, port), handler(collector))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://{host}:{server.server_address[1]}/pings"
+    return server, collector, url
+
+
+def post(url, batch, timeout=10.0):
+    """
+    Upload one batch, returns the number of pings the collector accepted
+    """
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(batch).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)["accepted"]
+
+
+class Uploader:
+    """
+    Sends the pings handed to it to the collector at url. What could not
+    be sent is kept (at most max_pending pings, the oldest are dropped
+    first) and sent with the next pings, once the retry delay, which
+    doubles with every failure up to max_backoff seconds, is over.
+    """
+
+    def __init__(
+        self, url, node, max_pending=1_000_000, max_backoff=300.0, timeout=10.0
+    ):
+        self.url = url
+        self.node = node
+        self.max_pending = max_pending
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.pending = []
+        self.backoff = 0.0
+        self.retry_at = 0.0
+
+    def pending_pings(self):
+        return sum(len(df) for df in self.pending)
+
+    def send(self, df):
+        """
+        Send df and everything still pending, returns whether all of it
+        was sent
+        """
+        if len(df):
+            self.pending.append(df)
+        while self.pending_pings() > self.max_pending:
+            dropped = self.pending.pop(0)
+            print(f"collector unreachable, dropped {len(dropped)} pings")
+        if not self.pending or time.monotonic() < self.retry_at:
+            return not self.pending
+        while self.pending:
+            batch = self.pending[0]
+            try:
+                post(
+                    self.url,
+                    to_batch(batch.iloc[:BATCH_SIZE], self.node),
+                    self.timeout,
+                )
+            except OSError as err:
+                self.backoff = min(
+                    max(2 * self.backoff, 1.0), self.max_backoff
+                )
+                self.retry_at = time.monotonic() + self.backoff
+                print(f"upload failed ({err}), retry in {self.backoff:g}s")
+                return False
+            # what was sent is not sent again
+            if len(batch) > BATCH_SIZE:
+                self.pending[0] = batch.iloc[BATCH_SIZE:]
+            else:
+                self.pending.pop(0)
+        self.backoff = 0.0
+        return True
+
+
+def push(url, node, log_file="pinger.log", state_file="push.state.json"):
+    """
+    Upload the samples appended to a pinger.sh log since the last
+    successful push (all of them when it was truncated since, see
+    analysis.resume_offset), returns their number. The state only moves
+    on when the collector accepted everything, so a failed push is sent
+    again by the next one.
+    """
+    from analysis import (
+        first_time,
+        fix_times,
+        load_state,
+        read_log_from,
+        resume_offset,
+        resume_state,
+        save_state,
+    )
+
+    stat = os.stat(log_file)
+    first = first_time(log_file)
+    offset = resume_offset(load_state(state_file), stat, first)
+    df, offset = read_log_from(log_file, offset, partial=False)
+    df, _ = fix_times(df)
+    for lo in range(0, len(df), BATCH_SIZE):
+        post(url, to_batch(df.iloc[lo : lo + BATCH_SIZE], node))
+    save_state(state_file, resume_state(stat, offset, first))
+    return len(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("serve", help="collect the uploads of the nodes")
+    p.add_argument("--root", default=COLLECTED_PATH)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8060)
+    p.add_argument("--flush", type=float, default=5.0, help="seconds")
+
+    p = commands.add_parser("push", help="upload what pinger.sh logged")
+    p.add_argument("url")
+    p.add_argument("--node", default=socket.gethostname())
+    p.add_argument("--log", default="pinger.log")
+    p.add_argument("--state", default="push.state.json")
+    args = parser.parse_args()
+
+    if args.command == "push":
+        print(
+            f"Pushed {push(args.url, args.node, args.log, args.state)} pings"
+        )
+    else:
+        collector = Collector(args.root)
+        collector.follow(args.flush)
+        server = ThreadingHTTPServer(
+            (args.host, args.port), handler(collector)
+        )
+        print(f"Collecting into {args.root} on {args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            print(f"Flushed {collector.flush()} pings")
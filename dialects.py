@@ -0,0 +1,234 @@
+"""
+Parsers for every log format the ping loggers ever wrote
+
+    pinger    pinger.sh: the date, then the raw ping -c 1 output
+    lag       archive/internet_lag_logger.sh: "2023-05-01 12:00:00 - Lag:
+              12.3 ms" or "... - Request timed out"
+    prefixed  archive/ping_logger.sh: the ping -qn -c2 summary with the
+              date in front of every line (through xargs)
+    loss      archive/ping_logging.sh: the date, then the "packets
+              transmitted" line of ping -qn -c2
+
+The dialect of a file is sniffed from its first few KB. Every parser
+works on a whole text buffer with compiled regular expressions and
+vectorized pandas string operations, and returns the same schema:
+
+    time    datetime64[ns]
+    target  the probed host (the logs that do not name it use the target
+            argument)
+    delay   ms, inf for a lost ping, NaN for a ping that was answered but
+            whose RTT was not logged
+
+The summary-only dialects log one line per run of several pings; they
+give one row per ping sent, so loss rates stay right.
+"""
+
+import argparse
+import re
+
+import numpy as np
+import pandas as pd
+
+import store
+import tiers
+
+SNIFF_SIZE = 4096
+
+DIALECTS = {}
+
+
+def register(name, sniff):
+    """
+    Register parse_text(text, target) as the parser of the dialect whose
+    files start with text matching the sniff pattern
+    """
+
+    def decorator(parse_text):
+        DIALECTS[name] = (re.compile(sniff, re.M), parse_text)
+        return parse_text
+
+    return decorator
+
+
+def frame(times, time_format, targets, delays):
+    """
+    The common schema, rows with unparseable times are dropped
+    """
+    df = pd.DataFrame(
+        {
+            "time": pd.to_datetime(
+                pd.Series(times, dtype=object),
+                format=time_format,
+                errors="coerce",
+            ),
+            "target": pd.Series(targets, dtype=object),
+            "delay": np.asarray(delays, dtype=np.float64),
+        }
+    )
+    return df[df["time"].notna()].reset_index(drop=True)
+
+
+def per_ping(times, targets, sent, received, delays):
+    """
+    One row per ping of summary lines: received rows with the delay and
+    sent - received rows with inf
+    """
+    sent = np.asarray(sent, dtype=np.int64)
+    received = np.minimum(np.asarray(received, dtype=np.int64), sent)
+    lost = sent - received
+    index = np.concatenate(
+        [
+            np.repeat(np.arange(len(sent)), received),
+            np.repeat(np.arange(len(sent)), lost),
+        ]
+    )
+    row_delays = np.concatenate(
+        [
+            np.repeat(np.asarray(delays, dtype=np.float64), received),
+            np.full(lost.sum(), np.inf),
+        ]
+    )
+    order = np.argsort(index, kind="stable")
+    return (
+        np.asarray(times, dtype=object)[index][order],
+        np.asarray(targets, dtype=object)[index][order],
+        row_delays[order],
+    )
+
+
+PINGER_BLOCK = re.compile(r"^([^\n]*)\nPING (\S+)[^\n]*\n([^\n]*)", re.M)
+
+
+@register("pinger", r"^\d\d/\d\d/\d\d-\d\d:\d\d:\d\d\r?\nPING ")
+def parse_pinger(text, target=None):
+    blocks = pd.DataFrame(
+        PINGER_BLOCK.findall(text), columns=["time", "target", "reply"]
+    )
+    delays = (
+        blocks["reply"]
+        .str.extract(r"time=([\d.]+)", expand=False)
+        .astype(float)
+        .fillna(np.inf)
+    )
+    return frame(
+        blocks["time"].str.rstrip("\r"),
+        "%m/%d/%y-%H:%M:%S",
+        blocks["target"],
+        delays,
+    )
+
+
+LAG_LINE = re.compile(
+    r"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) - "
+    r"(?:Lag: ([\d.]+)(?: ms)?|Request timed out)",
+    re.M,
+)
+
+
+@register("lag", r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d - (?:Lag:|Request timed)")
+def parse_lag(text, target=None):
+    lines = pd.DataFrame(LAG_LINE.findall(text), columns=["time", "delay"])
+    delays = pd.to_numeric(lines["delay"], errors="coerce").fillna(np.inf)
+    return frame(
+        lines["time"],
+        "%Y-%m-%d %H:%M:%S",
+        [target or store.DEFAULT_TARGET] * len(lines),
+        delays,
+    )
+
+
+PREFIXED_BLOCK = re.compile(
+    r"^\S+ \S+ PING (\S+).*?\n"
+    r"(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) (\d+) packets transmitted, "
+    r"(\d+) (?:packets )?received[^\n]*"
+    r"(?:\n\S+ \S+ (?:rtt|round-trip) \S+ = [\d.]+/([\d.]+)/)?",
+    re.M | re.S,
+)
+
+
+@register("prefixed", r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d PING ")
+def parse_prefixed(text, target=None):
+    blocks = pd.DataFrame(
+        PREFIXED_BLOCK.findall(text),
+        columns=["target", "time", "sent", "received", "delay"],
+    )
+    delays = pd.to_numeric(blocks["delay"], errors="coerce")
+    times, targets, delays = per_ping(
+        blocks["time"],
+        blocks["target"],
+        blocks["sent"].astype(int),
+        blocks["received"].astype(int),
+        delays,
+    )
+    return frame(times, "%Y-%m-%d %H:%M:%S", targets, delays)
+
+
+LOSS_BLOCK = re.compile(
+    r"^(\d\d/\d\d/\d\d-\d\d:\d\d:\d\d)\r?\n"
+    r"(\d+) packets transmitted, (\d+) (?:packets )?received",
+    re.M,
+)
+
+
+@register(
+    "loss", r"^\d\d/\d\d/\d\d-\d\d:\d\d:\d\d\r?\n\d+ packets transmitted"
+)
+def parse_loss(text, target=None):
+    blocks = pd.DataFrame(
+        LOSS_BLOCK.findall(text), columns=["time", "sent", "received"]
+    )
+    times, targets, delays = per_ping(
+        blocks["time"],
+        [target or store.DEFAULT_TARGET] * len(blocks),
+        blocks["sent"].astype(int),
+        blocks["received"].astype(int),
+        # the RTT is not logged
+        np.full(len(blocks), np.nan),
+    )
+    return frame(times, "%m/%d/%y-%H:%M:%S", targets, delays)
+
+
+def sniff(text):
+    """
+    The name of the dialect of a log that starts with text
+    """
+    for name, (pattern, _) in DIALECTS.items():
+        if pattern.search(text):
+            return name
+    raise ValueError("Unknown log format")
+
+
+def detect(file_name):
+    with open(file_name, "r", errors="replace") as f:
+        return sniff(f.read(SNIFF_SIZE))
+
+
+def read_any(file_name, dialect=None, target=None):
+    """
+    Read a log of any dialect (sniffed when not given) in one pass
+    """
+    with open(file_name, "r", errors="replace") as f:
+        text = f.read()
+    if dialect is None:
+        dialect = sniff(text[:SNIFF_SIZE])
+    _, parse_text = DIALECTS[dialect]
+    return parse_text(text, target)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="backfill the ping store from logs of any format"
+    )
+    parser.add_argument("logs", nargs="+")
+    parser.add_argument("--target", default=None)
+    args = parser.parse_args()
+
+    frames = []
+    for log in args.logs:
+        dialect = detect(log)
+        df = read_any(log, dialect, args.target)
+        print(f"{log}: {dialect}, {len(df)} pings")
+        frames.append(df)
+    df = pd.concat(frames).sort_values("time", kind="stable")
+    added = tiers.add_new_pings(df[["time", "target", "delay"]])
+    print(f"Added {added} new pings")
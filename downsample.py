@@ -0,0 +1,39 @@
+"""
+Downsampling of the ping scatter
+
+The time range is cut into equal buckets and only the fastest and the
+slowest ping of every bucket are kept. Unlike plain decimation this
+keeps every spike visible, and the plot looks the same as the full one
+at screen resolution.
+"""
+
+import numpy as np
+
+
+def minmax(times, delays, budget):
+    """
+    Indices of at most budget points of the sorted times: the min and max
+    delay of each of budget / 2 equal time buckets.
+    All indices are returned when there are no more than budget points.
+    """
+    n = len(times)
+    if n <= budget:
+        return np.arange(n)
+
+    buckets = max(budget // 2, 1)
+    edges = np.linspace(float(times[0]), float(times[-1]), buckets + 1)
+    starts = np.searchsorted(times, edges[:-1].astype(times.dtype))
+    starts = np.unique(np.append(starts, 0))
+    starts = starts[starts < n]
+    sizes = np.diff(np.append(starts, n))
+    segment = np.repeat(np.arange(len(starts)), sizes)
+
+    lows = np.minimum.reduceat(delays, starts)
+    highs = np.maximum.reduceat(delays, starts)
+    # the first position of the min and of the max of every bucket
+    is_low = np.flatnonzero(delays == lows[segment])
+    is_high = np.flatnonzero(delays == highs[segment])
+    _, first_low = np.unique(segment[is_low], return_index=True)
+    _, first_high = np.unique(segment[is_high], return_index=True)
+
+    return np.union1d(is_low[first_low], is_high[first_high])
@@ -0,0 +1,107 @@
+"""
+Memoization of the dashboard figures
+
+The figures of a date range only change when ingest adds pings, so they
+are cached under the normalized date range and the data version. The
+in-process cache is an LRU of bounded size, and with a directory it is
+backed by a diskcache.Cache that all the worker processes share.
+"""
+
+import functools
+from collections import OrderedDict
+
+import pandas as pd
+
+import metrics
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+
+def normalize(date):
+    """
+    the same key for every spelling of a date
+    """
+    if date is None:
+        return None
+    return pd.Timestamp(date).isoformat()
+
+
+class FigureCache:
+    """
+    LRU cache of at most maxsize entries, optionally shared through a
+    disk cache in directory (requires the diskcache package)
+    """
+
+    def __init__(self, maxsize=64, directory=None):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.disk = None
+        if directory is not None:
+            if diskcache is None:
+                raise ImportError("a shared figure cache requires diskcache")
+            self.disk = diskcache.Cache(directory)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            metrics.count("figure_cache", result="hit")
+            return self.entries[key]
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.hits += 1
+                metrics.count("figure_cache", result="disk hit")
+                self._remember(key, value)
+                return value
+        self.misses += 1
+        metrics.count("figure_cache", result="miss")
+        return None
+
+    def set(self, key, value):
+        self._remember(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def _remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def memoize(self, version):
+        """
+        Cache a function of a date range and of other arguments under the
+        normalized dates, the other arguments (lists as tuples) and
+        version(), which changes whenever the data does
+        """
+
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapper(start_date, end_date, *args):
+                key = (
+                    f.__name__,
+                    normalize(start_date),
+                    normalize(end_date),
+                    *(tuple(a) if isinstance(a, list) else a for a in args),
+                    version(),
+                )
+                value = self.get(key)
+                if value is None:
+                    value = f(start_date, end_date, *args)
+                    self.set(key, value)
+                return value
+
+            return wrapper
+
+        return decorator
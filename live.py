@@ -0,0 +1,182 @@
+"""
+The data the dashboard reads, followed live
+
+LiveData holds, for every target, the memory-mapped ping arrays, their
+TimeIndex and the hourly rollup. A background thread polls the data
+version that ingest bumps, and when it changes maps the grown arrays
+again and adds only the new pings to the indexes and to the rollups.
+The minute cells of the compacted days (see tiers.py) are read from
+disk when a range needs them.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+import pandas as pd
+
+import rollup
+import store
+import tiers
+from timeindex import TimeIndex, to_epoch
+
+
+class LiveData:
+    def __init__(
+        self,
+        arrays_path=store.ARRAYS_PATH,
+        rollup_path=rollup.ROLLUP_PATH,
+        version_path=store.VERSION_PATH,
+        targets_path=store.TARGETS_PATH,
+        minutes_path=tiers.MINUTES_PATH,
+        retention_path=tiers.RETENTION_PATH,
+    ):
+        self.arrays_path = arrays_path
+        self.rollup_path = rollup_path
+        self.version_path = version_path
+        self.targets_path = targets_path
+        self.minutes_path = minutes_path
+        self.retention_path = retention_path
+        self.thread = None
+        self.load()
+
+    def load(self):
+        """
+        Read everything from the stores
+        """
+        self.version = store.data_version(self.version_path)
+        self.targets = store.load_targets(self.targets_path)
+        self.retention = tiers.load_retention(self.retention_path)
+        self.indexes = {}
+        self.rollups = {}
+        for target in set(store.array_targets(self.arrays_path)) | {0}:
+            self.load_target(target)
+
+    def load_target(self, target):
+        self.indexes[target] = TimeIndex(
+            *store.open_arrays(self.arrays_path, target)
+        )
+        self.rollups[target] = rollup.Rollup.load(
+            rollup.rollup_file(self.rollup_path, target)
+        )
+
+    @property
+    def index(self):
+        """
+        The TimeIndex of target 0
+        """
+        return self.indexes[0]
+
+    @property
+    def cells(self):
+        """
+        The rollup of target 0
+        """
+        return self.rollups[0]
+
+    def merged_cells(self, targets):
+        """
+        The rollups of the targets merged into one
+        """
+        cells = rollup.Rollup.empty()
+        for target in targets:
+            if target in self.rollups:
+                cells = cells.merge(self.rollups[target])
+        return cells
+
+    def first(self):
+        """
+        The time of the oldest ping of any tier, epoch ns
+        """
+        firsts = [int(i.times[0]) for i in self.indexes.values() if len(i)]
+        firsts += [int(r.times[0]) for r in self.rollups.values() if len(r)]
+        return min(firsts) if firsts else None
+
+    def points(self, target, start, end, bins):
+        """
+        The good pings and the timeouts of a target between start and end
+        from the coarsest tier fine enough for bins time bins: the hourly
+        cells when a bin is an hour or longer, else the raw pings where
+        they are kept, and the minute and hourly cells of the compacted
+        days before them. A cell stands for its fastest and slowest ping.
+        """
+        if (to_epoch(end) - to_epoch(start)) / bins >= rollup.HOUR:
+            return tiers.cell_points(self.rollups[target].select(start, end))
+        index = self.indexes[target]
+        raw_since = self.retention["raw_since"]
+        # a full ingest after a compaction brings back older raw pings,
+        # their cells are drawn instead
+        raw_start = pd.Timestamp(max(to_epoch(start), raw_since))
+        goods = [index.good(raw_start, end)]
+        bads = [index.timeouts(raw_start, end)]
+        if raw_since and to_epoch(start) < raw_since:
+            end = min(pd.Timestamp(end), pd.Timestamp(raw_since))
+            minutes = tiers.read_cells(self.minutes_path, start, end, target)
+            hours = self.rollups[target].select(start, end)
+            for cells in (
+                tiers.cells_before(hours, self.retention["minutes_since"]),
+                tiers.cells_before(minutes, raw_since),
+            ):
+                good, bad = tiers.cell_points(cells)
+                goods.insert(-1, good)
+                bads.insert(-1, bad)
+        return (
+            pd.concat(goods, ignore_index=True),
+            pd.concat(bads, ignore_index=True),
+        )
+
+    def refresh(self):
+        """
+        Pick up the pings ingest added since the last look, returns the
+        number of new pings
+        """
+        version = store.data_version(self.version_path)
+        if version == self.version:
+            return 0
+        if tiers.load_retention(self.retention_path) != self.retention:
+            # compaction dropped pings from the arrays
+            n = sum(len(index) for index in self.indexes.values())
+            self.load()
+            return sum(len(index) for index in self.indexes.values()) - n
+        self.targets = store.load_targets(self.targets_path)
+        added = 0
+        for target in store.array_targets(self.arrays_path):
+            added += self.refresh_target(target)
+        self.version = version
+        return added
+
+    def refresh_target(self, target):
+        times, delays = store.open_arrays(self.arrays_path, target)
+        old = self.indexes.get(target)
+        n = len(old) if old is not None else 0
+        # ingest rewrites the arrays when it gets out of order pings,
+        # then there is nothing to extend
+        if (
+            old is None
+            or len(times) < n
+            or (n and times[n - 1] != old.times[-1])
+        ):
+            self.load_target(target)
+            return len(self.indexes[target]) - n
+        new = rollup.Rollup.from_arrays(
+            np.asarray(times[n:]), np.asarray(delays[n:], dtype=np.float64)
+        )
+        self.indexes[target] = old.extend(times, delays)
+        self.rollups[target] = self.rollups[target].merge(new)
+        return len(times) - n
+
+    def follow(self, interval):
+        """
+        Refresh every interval seconds in a daemon thread
+        """
+        if self.thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.refresh()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
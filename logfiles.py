@@ -0,0 +1,122 @@
+"""
+Rotated and compressed pinger.sh logs
+
+logrotate leaves pinger.log, pinger.log.1, pinger.log.2.gz, ... and the
+older ones may be compressed with gzip, xz or zstd. open_log opens any of
+them as a binary stream that is decompressed chunk by chunk as it is
+read (all the members of a gzip file, all the frames of a zstd file), so
+a file is never inflated whole in memory or on disk. Reading zstd files
+requires the zstandard package.
+
+rotation_set turns "pinger.log" (the log and its rotations) or a glob
+into the list of files, and extent finds the first and the last date
+line of a file, so the files can be put in the order of their contents
+rather than of their names, and its length once decompressed, which
+with them tells a file apart from the others after it was renamed or
+compressed.
+"""
+
+import bz2
+import glob
+import gzip
+import lzma
+import os
+import re
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# bytes read per iteration while looking for times
+CHUNK_SIZE = 1 << 20
+
+# the date line written by pinger.sh in front of every ping
+DATE_LINE = re.compile(rb"^(\d\d/\d\d/\d\d-\d\d:\d\d:\d\d)\r?$", re.M)
+
+# pinger.log.1, pinger.log.2.gz, pinger.log.3.zst, ...
+ROTATED = re.compile(r"\.\d+(\.(gz|xz|zst|bz2))?$")
+
+OPENERS = {
+    ".gz": gzip.open,
+    ".xz": lzma.open,
+    ".bz2": bz2.open,
+}
+
+
+def is_compressed(file_name):
+    return os.path.splitext(file_name)[1] in (*OPENERS, ".zst")
+
+
+def open_log(file_name):
+    """
+    Open a log, plain or compressed, for streaming binary reads
+    """
+    extension = os.path.splitext(file_name)[1]
+    if extension in OPENERS:
+        return OPENERS[extension](file_name, "rb")
+    if extension == ".zst":
+        if zstandard is None:
+            raise ImportError("reading .zst logs requires zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(file_name, "rb"), read_across_frames=True, closefd=True
+        )
+    return open(file_name, "rb")
+
+
+def rotation_set(pattern):
+    """
+    The files of pattern: a glob, or a log and its rotations
+    """
+    if glob.has_magic(pattern):
+        return sorted(glob.glob(pattern))
+    rotated = [
+        file_name
+        for file_name in glob.glob(glob.escape(pattern) + ".*")
+        if ROTATED.fullmatch(file_name[len(pattern) :])
+    ]
+    return [f for f in [pattern] if os.path.exists(f)] + sorted(rotated)
+
+
+def extent(file_name, chunk_size=CHUNK_SIZE):
+    """
+    The first and the last date line of a log (bytes, None when it has
+    none) and its length in bytes once decompressed. A plain file is only
+    read at its start and its end, a compressed one is streamed through.
+    """
+    first = last = None
+    length = 0
+    with open_log(file_name) as f:
+        tail = b""
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            length += len(chunk)
+            lines = tail + chunk
+            # the last line may be cut, it is searched with the next chunk
+            end = lines.rfind(b"\n") + 1
+            dates = DATE_LINE.findall(lines, 0, end)
+            tail = lines[end:]
+            if dates:
+                first = first or dates[0]
+                last = dates[-1]
+                if not is_compressed(file_name):
+                    break
+        if not is_compressed(file_name) and first is not None:
+            size = offset = os.fstat(f.fileno()).st_size
+            while offset > 0:
+                offset = max(offset - chunk_size, 0)
+                f.seek(offset)
+                dates = DATE_LINE.findall(f.read(size - offset))
+                if dates:
+                    last = dates[-1]
+                    break
+        else:
+            dates = DATE_LINE.findall(tail + b"\n")
+            if dates:
+                first = first or dates[0]
+                last = dates[-1]
+        if not is_compressed(file_name):
+            length = os.fstat(f.fileno()).st_size
+    return first, last, length
@@ -0,0 +1,188 @@
+"""
+Timers and counters of the hot paths
+
+    with metrics.timer("fix_times"):
+        ...
+    metrics.count("bad_times", bad_times)
+
+Every process keeps its metrics in memory. A counter only grows, a timer
+keeps the number, the sum and the max of its durations in seconds, and a
+gauge keeps the last value it was set to. A metric has a name and
+optional labels, and every one of their combinations is its own series.
+A timer costs two perf_counter_ns calls and a dict update under a lock,
+so it can wrap every parse, read and callback.
+
+prometheus_text() renders the metrics in the Prometheus text format, the
+dashboard serves it at /metrics (every worker process answers with its
+own metrics), and dump() writes them as JSON, which the batch jobs do
+with --metrics FILE.
+"""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+PREFIX = "pinger_"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+lock = threading.Lock()
+
+# (name, labels) -> value, labels are sorted (label, value) pairs
+counters = {}
+gauges = {}
+# (name, labels) -> [count, sum, max]
+timers = {}
+
+
+def series(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def count(name, n=1, **labels):
+    """
+    Add n to a counter
+    """
+    key = series(name, labels)
+    with lock:
+        counters[key] = counters.get(key, 0) + n
+
+
+def set_gauge(name, value, **labels):
+    key = series(name, labels)
+    with lock:
+        gauges[key] = value
+
+
+def observe(name, seconds, **labels):
+    """
+    Add a duration to a timer
+    """
+    key = series(name, labels)
+    with lock:
+        stats = timers.get(key)
+        if stats is None:
+            timers[key] = [1, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    """
+    Time the block, also when it raises
+    """
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter_ns() - start) / 1e9, **labels)
+
+
+def timed(name, **labels):
+    """
+    Time every call of the decorated function
+    """
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def reset():
+    with lock:
+        counters.clear()
+        gauges.clear()
+        timers.clear()
+
+
+def snapshot():
+    """
+    All the metrics as a dict of lists of series
+    """
+    with lock:
+        return {
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(counters.items())
+            ],
+            "gauges": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(gauges.items())
+            ],
+            "timers": [
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": n,
+                    "seconds": total,
+                    "max": longest,
+                }
+                for (name, labels), (n, total, longest) in sorted(
+                    timers.items()
+                )
+            ],
+        }
+
+
+def dump(path):
+    """
+    Write the snapshot as JSON to path, atomically
+    """
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(snapshot(), f, indent=1)
+    os.replace(tmp_file, path)
+
+
+def label_text(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def prometheus_text():
+    """
+    All the metrics in the Prometheus text exposition format: counters as
+    <name>_total (also the name of their family), timers as the summaries
+    <name>_seconds (count and sum) with the gauges <name>_seconds_max,
+    gauges as <name>
+    """
+    with lock:
+        families = {}
+        for (name, labels), value in counters.items():
+            base = f"{PREFIX}{name}_total"
+            family = families.setdefault((base, "counter"), [])
+            family.append(f"{base}{label_text(labels)} {value}")
+        for (name, labels), value in gauges.items():
+            family = families.setdefault((PREFIX + name, "gauge"), [])
+            family.append(f"{PREFIX}{name}{label_text(labels)} {value}")
+        for (name, labels), (n, total, longest) in timers.items():
+            base = f"{PREFIX}{name}_seconds"
+            labels = label_text(labels)
+            families.setdefault((base, "summary"), []).extend(
+                [f"{base}_count{labels} {n}", f"{base}_sum{labels} {total}"]
+            )
+            families.setdefault((base + "_max", "gauge"), []).append(
+                f"{base}_max{labels} {longest}"
+            )
+    lines = []
+    for (name, kind), samples in sorted(families.items()):
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(sorted(samples))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,260 @@
+"""
+Rolling statistics and outage detection over a stream of pings
+
+    python monitor.py [--window 300] [--quantile 0.95] [--timeouts 3]
+
+StreamMonitor keeps the pings of the last window seconds in a queue and
+their delays in a histogram over the log-spaced buckets of rollup.py.
+Adding a ping and dropping the ones that left the window are O(1), and
+the quantile is tracked by a pointer into the histogram that only moves
+by the few buckets the counts changed, so every ping costs O(1)
+amortized whatever the window size. The quantile is interpolated inside
+its bucket like the rollup ones, so it is within a few percent of the
+exact one.
+
+An outage starts when timeouts_to_open pings in a row are lost, or when
+the loss rate of the window reaches open_loss_rate (once it holds at
+least min_pings), and ends at the first answered ping after which the
+loss rate is at most close_loss_rate.
+
+The prober feeds one monitor per target (see prober.outage_printer) and
+monitor() runs the same code over stored arrays, so both find the same
+outages.
+"""
+
+import argparse
+import bisect
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+import store
+from records import OK, TIMEOUT, status_of
+from rollup import BUCKETS, N_BUCKETS, bucket_of
+
+SECOND = 10**9
+
+EDGES = BUCKETS.tolist()
+
+# a lost ping, or an answered one whose delay is unknown
+NO_BUCKET = -1
+
+
+class Outage:
+    def __init__(self, start, reason):
+        self.start = start
+        self.reason = reason
+        self.end = None
+        self.lost = 0
+
+    def __repr__(self):
+        end = pd.Timestamp(self.end) if self.end is not None else "..."
+        return (
+            f"Outage({pd.Timestamp(self.start)} - {end}, {self.reason},"
+            f" {self.lost} lost)"
+        )
+
+
+class StreamMonitor:
+    def __init__(
+        self,
+        window=300,
+        q=0.95,
+        timeouts_to_open=3,
+        open_loss_rate=0.5,
+        close_loss_rate=0.2,
+        min_pings=10,
+    ):
+        self.window = int(window * SECOND)
+        self.q = q
+        self.timeouts_to_open = timeouts_to_open
+        self.open_loss_rate = open_loss_rate
+        self.close_loss_rate = close_loss_rate
+        self.min_pings = min_pings
+
+        # (time, bucket) of the pings in the window
+        self.pings = deque()
+        self.lost = 0
+        self.hist = [0] * N_BUCKETS
+        self.replies = 0
+        # bucket of the quantile and the number of delays below it
+        self.bucket = 0
+        self.below = 0
+
+        self.run = 0
+        self.run_start = None
+        self.outage = None
+
+    def __len__(self):
+        return len(self.pings)
+
+    @property
+    def loss_rate(self):
+        return self.lost / len(self.pings) if self.pings else np.nan
+
+    @property
+    def quantile(self):
+        """
+        The q quantile of the delays in the window
+        """
+        if not self.replies:
+            return np.nan
+        in_bucket = self.hist[self.bucket]
+        fraction = min(
+            max((self.q * self.replies - self.below) / in_bucket, 0), 1
+        )
+        low = EDGES[self.bucket]
+        return low * (EDGES[self.bucket + 1] / low) ** fraction
+
+    def update(self, time, delay, status=None):
+        """
+        Add a ping (epoch ns, ms, status code; pings must come in time
+        order), returns the outage it closed or opened, else None
+        """
+        if status is None:
+            status = OK if delay != np.inf else TIMEOUT
+        bucket = NO_BUCKET
+        if status == OK and delay == delay:
+            bucket = min(
+                max(bisect.bisect_right(EDGES, delay) - 1, 0), N_BUCKETS - 1
+            )
+        return self.add(time, bucket, status != OK)
+
+    def add(self, time, bucket, lost):
+        """
+        update() with the bucket of the delay already known
+        """
+        pings = self.pings
+        pings.append((time, bucket if not lost else None))
+        if lost:
+            self.lost += 1
+        elif bucket != NO_BUCKET:
+            self.hist[bucket] += 1
+            self.replies += 1
+            if bucket < self.bucket:
+                self.below += 1
+        cutoff = time - self.window
+        while pings[0][0] <= cutoff:
+            _, old = pings.popleft()
+            if old is None:
+                self.lost -= 1
+            elif old != NO_BUCKET:
+                self.hist[old] -= 1
+                self.replies -= 1
+                if old < self.bucket:
+                    self.below -= 1
+        self.move_quantile()
+        return self.detect(time, lost)
+
+    def move_quantile(self):
+        """
+        Move the quantile pointer to the first bucket where the count of
+        delays up to it reaches q * replies
+        """
+        if not self.replies:
+            return
+        hist = self.hist
+        target = self.q * self.replies
+        while self.below + hist[self.bucket] < target:
+            self.below += hist[self.bucket]
+            self.bucket += 1
+        while self.bucket > 0 and self.below >= target:
+            self.bucket -= 1
+            self.below -= hist[self.bucket]
+
+    def detect(self, time, lost):
+        if lost:
+            if not self.run:
+                self.run_start = time
+            self.run += 1
+        else:
+            self.run = 0
+
+        outage = self.outage
+        if outage is not None:
+            if lost:
+                outage.lost += 1
+            elif self.loss_rate <= self.close_loss_rate:
+                outage.end = time
+                self.outage = None
+                return outage
+            return None
+
+        if lost and self.run >= self.timeouts_to_open:
+            outage = Outage(self.run_start, f"{self.run} timeouts")
+            outage.lost = self.run
+        elif (
+            len(self.pings) >= self.min_pings
+            and self.loss_rate >= self.open_loss_rate
+        ):
+            outage = Outage(time, f"{self.loss_rate:.0%} lost")
+            outage.lost = int(lost)
+        else:
+            return None
+        self.outage = outage
+        return outage
+
+
+def monitor(times, delays, status=None, monitor=None, **kwargs):
+    """
+    Run a StreamMonitor over sorted arrays of epoch-ns times and delays,
+    returns a frame of the rolling loss rate and quantile after every
+    ping and the list of outages
+    """
+    if monitor is None:
+        monitor = StreamMonitor(**kwargs)
+    delays = np.asarray(delays, dtype=np.float64)
+    if status is None:
+        status = status_of(delays)
+    lost = np.asarray(status) != OK
+    buckets = np.where(
+        lost | np.isnan(delays), NO_BUCKET, bucket_of(delays)
+    ).tolist()
+
+    loss_rate = np.empty(len(delays))
+    quantile = np.empty(len(delays))
+    outages = []
+    for i, (time, bucket, is_lost) in enumerate(
+        zip(np.asarray(times).tolist(), buckets, lost.tolist())
+    ):
+        outage = monitor.add(time, bucket, is_lost)
+        if outage is not None and outage.end is None:
+            outages.append(outage)
+        loss_rate[i] = monitor.loss_rate
+        quantile[i] = monitor.quantile
+    stats = pd.DataFrame(
+        {
+            "time": np.asarray(times).view("datetime64[ns]"),
+            "loss_rate": loss_rate,
+            f"p{monitor.q * 100:g}": quantile,
+        }
+    )
+    return stats, outages
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="rolling statistics and outages of the stored pings"
+    )
+    parser.add_argument("--window", type=float, default=300, help="seconds")
+    parser.add_argument("--quantile", type=float, default=0.95)
+    parser.add_argument("--timeouts", type=int, default=3)
+    parser.add_argument("--open-loss-rate", type=float, default=0.5)
+    parser.add_argument("--close-loss-rate", type=float, default=0.2)
+    parser.add_argument("--target", default=store.DEFAULT_TARGET)
+    args = parser.parse_args()
+
+    times, delays = store.open_arrays(target=store.target_code(args.target))
+    _, outages = monitor(
+        np.asarray(times),
+        delays,
+        window=args.window,
+        q=args.quantile,
+        timeouts_to_open=args.timeouts,
+        open_loss_rate=args.open_loss_rate,
+        close_loss_rate=args.close_loss_rate,
+    )
+    for outage in outages:
+        print(outage)
+    print(f"{len(outages)} outages")
@@ -0,0 +1,552 @@
+"""
+Long-running asyncio prober, the replacement of pinger.sh
+
+    python prober.py 8.8.8.8 tcp:example.com:443@0.5 udp:1.1.1.1:53
+
+Every target is probed on its own schedule (interval seconds, plus or
+minus jitter), and every probe runs as its own task under a timeout, so
+a slow or dead target never delays the others. A target is written as
+
+    [method:]host[:port][@interval]
+
+where method is icmp (the default), tcp or udp. ICMP echo goes through
+an unprivileged datagram socket (SOCK_DGRAM + IPPROTO_ICMP, allowed on
+macOS and on Linux within net.ipv4.ping_group_range); when the system
+does not allow it the target is probed with a TCP connect instead.
+
+The results are collected every --flush seconds and written to the ping
+store in probes/, where every target has its own code, every
+--write-every seconds (every write rewrites the partitions of the day),
+with --collector to a collector (see collector.py), or with --records to
+a binary record file (see records.py).
+
+How late the probes start compared to their schedule (the event loop
+lag), the probes per target and status and the time taken by the sink
+are kept in metrics.py, --metrics FILE writes them as JSON after every
+flush.
+"""
+
+import argparse
+import asyncio
+import random
+import socket
+import struct
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+import collector
+import metrics
+import records
+import store
+from monitor import StreamMonitor
+
+PROBES_PATH = "probes"
+
+DEFAULT_PORTS = {"tcp": 443, "udp": 33434}
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+
+class Target:
+    def __init__(self, host, method="icmp", port=None, interval=1.0):
+        self.host = host
+        self.method = method
+        self.port = port if port is not None else DEFAULT_PORTS.get(method)
+        self.interval = interval
+        # stays the same when an icmp target falls back to tcp
+        self.name = (
+            host if method == "icmp" else f"{method}:{host}:{self.port}"
+        )
+
+    @classmethod
+    def parse(cls, spec, interval=1.0):
+        """
+        A target from "[method:]host[:port][@interval]"
+        """
+        if "@" in spec:
+            spec, every = spec.rsplit("@", 1)
+            interval = float(every)
+        method = "icmp"
+        if spec.split(":", 1)[0] in ("icmp", "tcp", "udp"):
+            method, spec = spec.split(":", 1)
+        port = None
+        if spec.count(":") == 1:
+            spec, port = spec.split(":")
+            port = int(port)
+        return cls(spec, method, port, interval)
+
+    def __repr__(self):
+        return f"Target({self.name!r}, every {self.interval}s)"
+
+
+def icmp_available():
+    """
+    whether unprivileged ICMP datagram sockets are allowed here
+    """
+    try:
+        socket.socket(
+            socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP
+        ).close()
+        return True
+    except OSError:
+        return False
+
+
+def checksum(data):
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def echo_request(ident, seq):
+    payload = struct.pack("!d", time.time())
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    return (
+        struct.pack(
+            "!BBHHH",
+            ICMP_ECHO_REQUEST,
+            0,
+            checksum(header + payload),
+            ident,
+            seq,
+        )
+        + payload
+    )
+
+
+async def recvmsg(sock, size=1024, ancillary=64):
+    """
+    socket.recvmsg for a non-blocking socket
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            return sock.recvmsg(size, ancillary)
+        except BlockingIOError:
+            pass
+        readable = loop.create_future()
+        loop.add_reader(sock.fileno(), readable.set_result, None)
+        try:
+            await readable
+        finally:
+            loop.remove_reader(sock.fileno())
+
+
+async def probe_icmp(target, seq):
+    """
+    One echo request, returns (rtt seconds, ttl or -1)
+    """
+    loop = asyncio.get_running_loop()
+    address = (
+        await loop.getaddrinfo(target.host, None, family=socket.AF_INET)
+    )[0][4][0]
+    sock = socket.socket(
+        socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP
+    )
+    try:
+        sock.setblocking(False)
+        if hasattr(socket, "IP_RECVTTL"):
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_RECVTTL, 1)
+        start = time.perf_counter()
+        await loop.sock_sendto(sock, echo_request(0, seq), (address, 0))
+        while True:
+            data, ancdata, _, _ = await recvmsg(sock)
+            # the kernel may or may not leave the IP header in front
+            if len(data) >= 20 and data[0] >> 4 == 4:
+                data = data[(data[0] & 0x0F) * 4 :]
+            kind, _, _, _, reply_seq = struct.unpack("!BBHHH", data[:8])
+            if kind == ICMP_ECHO_REPLY and reply_seq == seq:
+                break
+        rtt = time.perf_counter() - start
+        ttl = -1
+        for level, kind, value in ancdata:
+            if level == socket.IPPROTO_IP and kind == getattr(
+                socket, "IP_TTL", None
+            ):
+                ttl = int.from_bytes(value[:4], sys.byteorder)
+        return rtt, ttl
+    finally:
+        sock.close()
+
+
+async def probe_tcp(target, seq):
+    """
+    Time a TCP handshake, a refused connection also counts as an answer
+    """
+    start = time.perf_counter()
+    try:
+        _, writer = await asyncio.open_connection(target.host, target.port)
+    except ConnectionRefusedError:
+        return time.perf_counter() - start, -1
+    rtt = time.perf_counter() - start
+    writer.close()
+    return rtt, -1
+
+
+class UdpProbe(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.answer = asyncio.get_running_loop().create_future()
+
+    def datagram_received(self, data, addr):
+        if not self.answer.done():
+            self.answer.set_result(None)
+
+    def error_received(self, exc):
+        # ICMP port unreachable: the host is there
+        if not self.answer.done():
+            if isinstance(exc, ConnectionRefusedError):
+                self.answer.set_result(None)
+            else:
+                self.answer.set_exception(exc)
+
+
+async def probe_udp(target, seq):
+    """
+    Time a datagram until an echo or a port-unreachable comes back
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        UdpProbe, remote_addr=(target.host, target.port)
+    )
+    try:
+        start = time.perf_counter()
+        transport.sendto(struct.pack("!Hd", seq, time.time()))
+        await protocol.answer
+        return time.perf_counter() - start, -1
+    finally:
+        transport.close()
+
+
+PROBES = {"icmp": probe_icmp, "tcp": probe_tcp, "udp": probe_udp}
+
+
+class Prober:
+    """
+    Probe targets concurrently and hand the results to sink (a function
+    of a DataFrame of time, target, delay in ms (inf when lost), status
+    and ttl) every flush_interval seconds. observe, when given, sees
+    every result once, before the sink, also when the sink fails and the
+    results are handed to it again with the next flush.
+    """
+
+    def __init__(
+        self,
+        targets,
+        sink,
+        timeout=2.0,
+        jitter=0.1,
+        flush_interval=5.0,
+        observe=None,
+    ):
+        self.targets = targets
+        self.sink = sink
+        self.observe = observe
+        self.timeout = timeout
+        self.jitter = jitter
+        self.flush_interval = flush_interval
+        self.results = []
+        # taken results the sink failed on
+        self.unsent = None
+        self.tasks = set()
+        if not icmp_available():
+            for target in targets:
+                if target.method == "icmp":
+                    target.method = "tcp"
+                    target.port = DEFAULT_PORTS["tcp"]
+
+    async def probe(self, target, seq):
+        when = time.time_ns()
+        try:
+            rtt, ttl = await asyncio.wait_for(
+                PROBES[target.method](target, seq), self.timeout
+            )
+            delay, status = rtt * 1000, "ok"
+        except asyncio.TimeoutError:
+            delay, status, ttl = np.inf, "timeout", -1
+        except OSError:
+            delay, status, ttl = np.inf, "error", -1
+        self.results.append((when, target.name, delay, status, ttl))
+        metrics.count("probes", target=target.name, status=status)
+
+    async def schedule(self, target):
+        loop = asyncio.get_running_loop()
+        # spread the first probes of all the targets over one interval
+        next_time = loop.time() + random.uniform(0, target.interval)
+        seq = 0
+        while True:
+            await asyncio.sleep(max(next_time - loop.time(), 0))
+            metrics.observe(
+                "prober_lag",
+                max(loop.time() - next_time, 0.0),
+                target=target.name,
+            )
+            task = asyncio.create_task(self.probe(target, seq & 0xFFFF))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            seq += 1
+            next_time += max(
+                target.interval + random.uniform(-self.jitter, self.jitter), 0
+            )
+
+    def take_results(self, cutoff=None):
+        """
+        The results of the probes started before cutoff (ns), all when it
+        is None. Probes started later may still be running, holding them
+        back keeps the batches handed to the sink in time order.
+        """
+        results = self.results
+        if cutoff is not None:
+            results = [r for r in self.results if r[0] < cutoff]
+            self.results = [r for r in self.results if r[0] >= cutoff]
+        else:
+            self.results = []
+        df = pd.DataFrame(
+            results, columns=["time", "target", "delay", "status", "ttl"]
+        )
+        df["time"] = pd.to_datetime(df["time"])
+        return df.sort_values("time", kind="stable")
+
+    def batch(self, cutoff=None):
+        """
+        The results for the sink: the unsent ones followed by the ones
+        take_results(cutoff) takes, which are observed first
+        """
+        df = self.take_results(cutoff)
+        if len(df) and self.observe is not None:
+            self.observe(df)
+        if self.unsent is not None:
+            df = pd.concat([self.unsent, df]) if len(df) else self.unsent
+            self.unsent = None
+        return df
+
+    async def flush(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            # every probe started before now - timeout is done
+            df = self.batch(time.time_ns() - int((self.timeout + 1) * 1e9))
+            if len(df):
+                try:
+                    # writing is blocking, keep it off the event loop
+                    await loop.run_in_executor(None, self.sink, df)
+                except Exception as err:
+                    print(f"flush failed ({err!r}), kept for the next one")
+                    self.unsent = df
+
+    async def run(self, duration=None):
+        """
+        Probe until cancelled, or for duration seconds
+        """
+        jobs = [asyncio.create_task(self.schedule(t)) for t in self.targets]
+        jobs.append(asyncio.create_task(self.flush()))
+        try:
+            await asyncio.sleep(duration if duration is not None else 1e12)
+        finally:
+            for job in jobs:
+                job.cancel()
+            if self.tasks:
+                await asyncio.wait(self.tasks)
+            df = self.batch()
+            if len(df):
+                self.sink(df)
+
+
+class StoreWriter:
+    """
+    Adds the results handed to add to the ping store in path, at most
+    every `every` seconds: a write rewrites the day partitions and the
+    rollups of the targets, so writing a few results at a time would
+    make every flush as slow as the day is long. What could not be
+    written is kept for the next write, write() writes what is left.
+    """
+
+    def __init__(self, path=PROBES_PATH, every=60.0):
+        self.path = path
+        self.every = every
+        self.pending = []
+        self.written_at = time.monotonic()
+
+    def add(self, df):
+        self.pending.append(df[["time", "target", "delay", "status"]])
+        if time.monotonic() - self.written_at >= self.every:
+            self.write()
+
+    def write(self):
+        self.written_at = time.monotonic()
+        if not self.pending:
+            return
+        df = pd.concat(self.pending, ignore_index=True)
+        try:
+            store.add_pings(df.sort_values("time", kind="stable"), self.path)
+        except (OSError, ValueError, pa.ArrowException) as err:
+            print(f"writing {len(df)} results failed ({err!r}), kept")
+            return
+        self.pending = []
+
+
+def upload_sink(url, node):
+    """
+    A sink that uploads the results to the collector at url as node,
+    keeping what could not be sent for the next time
+    """
+    return collector.Uploader(url, node).send
+
+
+def record_sink(path):
+    """
+    A sink that appends the results to the binary record file at path
+    """
+
+    def sink(df):
+        records.append_records(df, path)
+
+    return sink
+
+
+def metrics_sink(sink, path):
+    """
+    A sink that times sink and then writes the metrics as JSON to path
+    """
+
+    def timed(df):
+        with metrics.timer("prober_sink"):
+            sink(df)
+        metrics.dump(path)
+
+    return timed
+
+
+def outage_printer(**kwargs):
+    """
+    An observer for Prober that runs a StreamMonitor (with kwargs) per
+    target over the results and prints the outages it opens and closes
+    """
+    monitors = {}
+
+    def observe(df):
+        # the stores keep float32 delays, so does the monitor, to find the
+        # same outages as one run later over the stored pings
+        delays = df["delay"].to_numpy(np.float32).astype(np.float64)
+        status = records.status_codes(df)
+        for ns, name, delay, code in zip(
+            df["time"].to_numpy().view(np.int64).tolist(),
+            df["target"],
+            delays.tolist(),
+            status.tolist(),
+        ):
+            if name not in monitors:
+                monitors[name] = StreamMonitor(**kwargs)
+            outage = monitors[name].update(ns, delay, code)
+            if outage is not None:
+                print(
+                    f"{name}: {'ended' if outage.end else 'started'} {outage}"
+                )
+
+    return observe
+
+
+class Responder(asyncio.DatagramProtocol):
+    """
+    Stand-in for a remote host: echoes every datagram after delay seconds
+    and drops a loss fraction of them
+    """
+
+    def __init__(self, delay=0.0, loss=0.0):
+        self.delay = delay
+        self.loss = loss
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if random.random() < self.loss:
+            return
+        asyncio.get_running_loop().call_later(
+            self.delay, self.transport.sendto, data, addr
+        )
+
+
+async def stand_in(host="127.0.0.1", port=0, delay=0.0, loss=0.0):
+    """
+    Start a UDP echo responder and a TCP listener on host, returns the UDP
+    transport, the TCP server and the port both listen on
+    """
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: Responder(delay, loss), local_addr=(host, port)
+    )
+    port = transport.get_extra_info("sockname")[1]
+
+    async def accept(reader, writer):
+        writer.close()
+
+    server = await asyncio.start_server(accept, host, port)
+    return transport, server, port
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("targets", nargs="+", help="[method:]host[:port][@s]")
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=2.0)
+    parser.add_argument("--flush", type=float, default=5.0)
+    parser.add_argument(
+        "--write-every",
+        type=float,
+        default=60.0,
+        help="seconds between two writes to the ping store",
+    )
+    parser.add_argument("--duration", type=float, default=None)
+    parser.add_argument(
+        "--outages",
+        action="store_true",
+        help="print the outages of every target as they start and end",
+    )
+    parser.add_argument(
+        "--records",
+        metavar="FILE",
+        help="write binary records to FILE instead of the ping stores",
+    )
+    parser.add_argument(
+        "--collector",
+        metavar="URL",
+        help="upload the results to the collector at URL instead",
+    )
+    parser.add_argument("--node", default=socket.gethostname())
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="write the timings as JSON to FILE after every flush",
+    )
+    args = parser.parse_args()
+
+    targets = [Target.parse(t, args.interval) for t in args.targets]
+    writer = StoreWriter(every=args.write_every)
+    sink = record_sink(args.records) if args.records else writer.add
+    if args.collector:
+        sink = upload_sink(args.collector, args.node)
+    if args.metrics:
+        sink = metrics_sink(sink, args.metrics)
+    prober = Prober(
+        targets,
+        sink,
+        timeout=args.timeout,
+        jitter=args.jitter,
+        flush_interval=args.flush,
+        observe=outage_printer() if args.outages else None,
+    )
+    try:
+        asyncio.run(prober.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        writer.write()
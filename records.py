@@ -0,0 +1,228 @@
+"""
+Fixed-size binary ping records
+
+Every probe is one 16 byte little-endian record:
+
+    time    int64   epoch nanoseconds of the probe
+    rtt_us  uint32  round trip time in microseconds (0 when lost)
+    target  uint16  id of the target, see below
+    status  uint8   OK, TIMEOUT or ERROR
+    ttl     uint8   TTL of the reply, 0 when unknown
+
+Records are appended in time order, so a file is a sorted array that can
+be memory-mapped, bisected by time and parsed with numpy.frombuffer. The
+target ids are the positions of the target names in the JSON list kept
+next to the file in <file>.targets.
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+RECORD = np.dtype(
+    [
+        ("time", "<i8"),
+        ("rtt_us", "<u4"),
+        ("target", "<u2"),
+        ("status", "u1"),
+        ("ttl", "u1"),
+    ]
+)
+
+OK = 0
+TIMEOUT = 1
+ERROR = 2
+
+STATUS = {"ok": OK, "timeout": TIMEOUT, "error": ERROR}
+
+
+def status_of(delays):
+    """
+    The status of pings stored with the old convention of a delay of inf
+    for a lost ping
+    """
+    return np.where(np.isinf(delays), TIMEOUT, OK).astype(np.uint8)
+
+
+def status_codes(df):
+    """
+    The status codes of the pings of a frame whose status column holds
+    codes or names ("ok", "timeout", "error"), derived from the delays
+    when it has none
+    """
+    if "status" not in df:
+        return status_of(df["delay"].to_numpy(np.float64))
+    if df["status"].dtype == object:
+        return df["status"].map(STATUS).to_numpy(np.uint8)
+    return df["status"].to_numpy(np.uint8)
+
+
+def load_names(file_name):
+    """
+    The names in the JSON list in file_name, their positions are their ids
+    """
+    try:
+        with open(file_name, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def add_names(file_name, names, first=()):
+    """
+    The ids of names in the JSON list in file_name, new names are added
+    to the list. A new list starts with the names in first.
+    """
+    known_names = load_names(file_name) or list(first)
+    known = {name: i for i, name in enumerate(known_names)}
+    added = not os.path.exists(file_name) and bool(known_names)
+    for name in names:
+        if name not in known:
+            known[name] = len(known_names)
+            known_names.append(name)
+            added = True
+    if added:
+        tmp_file = file_name + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(known_names, f)
+        os.replace(tmp_file, file_name)
+    return known
+
+
+def targets_file(path):
+    return path + ".targets"
+
+
+def load_targets(path):
+    return load_names(targets_file(path))
+
+
+def target_ids(path, names):
+    """
+    The ids of the target names, new names are added to the target list
+    """
+    return add_names(targets_file(path), names)
+
+
+def to_records(df, ids):
+    """
+    Records from a frame of time, target, delay (ms, inf when lost) and
+    optionally status and ttl; ids maps target names to ids
+    """
+    records = np.zeros(len(df), RECORD)
+    records["time"] = pd.to_datetime(df["time"]).to_numpy("datetime64[ns]")
+    delays = df["delay"].to_numpy(np.float64)
+    lost = ~np.isfinite(delays)
+    records["rtt_us"] = np.where(lost, 0, np.rint(delays * 1000))
+    records["target"] = df["target"].map(ids).to_numpy()
+    records["status"] = status_codes(df)
+    if "ttl" in df:
+        records["ttl"] = np.clip(df["ttl"].to_numpy(), 0, 255)
+    return records
+
+
+def append_records(df, path):
+    """
+    Append the pings in df to the record file at path, sorted by time
+    """
+    if len(df) == 0:
+        return
+    df = df.sort_values("time", kind="stable")
+    records = to_records(df, target_ids(path, df["target"].unique()))
+    with open(path, "ab") as f:
+        records.tofile(f)
+
+
+def open_records(path):
+    """
+    Map a record file read-only
+    """
+    if not os.path.exists(path) or os.path.getsize(path) < RECORD.itemsize:
+        return np.empty(0, RECORD)
+    n = os.path.getsize(path) // RECORD.itemsize
+    return np.memmap(path, dtype=RECORD, mode="r", shape=(n,))
+
+
+def from_bytes(buffer):
+    """
+    Records from bytes read from a record file, a trailing partial record
+    is ignored
+    """
+    n = len(buffer) // RECORD.itemsize
+    return np.frombuffer(buffer, dtype=RECORD, count=n)
+
+
+def between(records, start=None, end=None):
+    """
+    The records between start and end (inclusive), by binary search
+    """
+    lo, hi = 0, len(records)
+    if start is not None:
+        lo = np.searchsorted(
+            records["time"], pd.Timestamp(start).value, side="left"
+        )
+    if end is not None:
+        hi = np.searchsorted(
+            records["time"], pd.Timestamp(end).value, side="right"
+        )
+    return records[lo:hi]
+
+
+def to_frame(records, targets):
+    """
+    A frame of time, target, delay (ms, inf when lost), status and ttl
+    """
+    ok = records["status"] == OK
+    return pd.DataFrame(
+        {
+            "time": records["time"].view("datetime64[ns]"),
+            "target": pd.Categorical.from_codes(
+                records["target"].astype(np.int64), categories=targets
+            ),
+            "delay": np.where(ok, records["rtt_us"] / 1000, np.inf),
+            "status": records["status"],
+            "ttl": records["ttl"],
+        }
+    )
+
+
+def read_records(path, start=None, end=None):
+    """
+    The pings of a record file between start and end as a frame
+    """
+    return to_frame(
+        between(open_records(path), start, end), load_targets(path)
+    )
+
+
+def convert_log(log_file, path, target="8.8.8.8"):
+    """
+    Convert a pinger.sh log to a record file, returns the number of
+    records and of bad times
+    """
+    # imported here, the prober writes records and does not need analysis
+    from analysis import fix_times, read_log
+
+    df, bad_times = fix_times(read_log(log_file))
+    df["target"] = target
+    if os.path.exists(path):
+        os.remove(path)
+    append_records(df, path)
+    return len(df), bad_times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="convert a pinger.sh log to binary records"
+    )
+    parser.add_argument("log_file", nargs="?", default="pinger.log")
+    parser.add_argument("path", nargs="?", default="pinger.rec")
+    parser.add_argument("--target", default="8.8.8.8")
+    args = parser.parse_args()
+
+    n, bad_times = convert_log(args.log_file, args.path, args.target)
+    print(f"Converted {n} pings to {args.path}")
+    print(f"Number of bad times: {bad_times}")
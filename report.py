@@ -0,0 +1,387 @@
+"""
+Batch report: all the plots of the ping history from one load
+
+    python report.py [--out DIR] [--width 1000] [--height 250]
+
+The pings are read once from the memory-mapped array store and binned
+into a width x height density image (time on x, log delay on y), so the
+size and the drawing time of the scatter do not grow with the history:
+every pixel is a count of pings, the timeouts are a row of marks at the
+top. When a pixel is an hour or wider the image is drawn from the
+histograms of the hourly rollup instead, and the days whose raw pings
+were compacted (see tiers.py) are drawn from their minute or hourly
+cells. The median bar and heatmap are merged from the hourly rollup.
+
+Writes ping.png (matplotlib, no display needed), pings.html (with
+plotly.js) and pings_online.html (plotly.js from the CDN).
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import store
+import tiers
+from rollup import BUCKETS, HOUR, ROLLUP_PATH, Rollup, rollup_file
+
+WIDTH = 1000
+HEIGHT = 250
+
+# y range of the density image, the range of the rollup buckets
+LOG_LOW = np.log10(BUCKETS[0])
+LOG_HIGH = np.log10(BUCKETS[-1])
+
+# where the timeouts are drawn, as in the old scatter plots
+TIMEOUT_DELAY = 5
+
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+class Density:
+    """
+    Pings counted on a grid of time x log10(delay) bins, and the
+    timeouts counted per time bin
+    """
+
+    def __init__(
+        self, times, delays, width=WIDTH, height=HEIGHT, start=None, end=None
+    ):
+        self.start = start if start is not None else 0
+        # the times need not be sorted
+        if start is None and len(times):
+            self.start = int(np.min(times))
+        self.end = end if end is not None else self.start + 1
+        if end is None and len(times):
+            self.end = int(np.max(times)) + 1
+        self.width = width
+        self.height = height
+        self.counts = np.zeros((height, width), np.int64)
+        self.timeouts = np.zeros(width, np.int64)
+        self.add(times, delays)
+
+    def columns(self, times):
+        return np.clip(
+            (
+                (np.asarray(times) - self.start)
+                / (self.end - self.start)
+                * self.width
+            ).astype(np.int64),
+            0,
+            self.width - 1,
+        )
+
+    def rows(self, delays):
+        y = (
+            (np.log10(np.maximum(delays, BUCKETS[0])) - LOG_LOW)
+            / (LOG_HIGH - LOG_LOW)
+            * self.height
+        ).astype(np.int64)
+        return np.clip(y, 0, self.height - 1)
+
+    def add(self, times, delays, weights=None, timeouts=None):
+        """
+        Count pings (times, delays), weights times each when given, and
+        timeouts at times when given, else the pings whose delay is inf
+        """
+        delays = np.asarray(delays, dtype=np.float64)
+        x = self.columns(times)
+        replied = np.isfinite(delays)
+        if weights is not None:
+            weights = np.asarray(weights)[replied]
+        self.counts += (
+            np.bincount(
+                self.rows(delays[replied]) * self.width + x[replied],
+                weights=weights,
+                minlength=self.width * self.height,
+            )
+            .reshape(self.height, self.width)
+            .astype(np.int64)
+        )
+        if timeouts is None:
+            timeouts = np.isinf(delays)
+        self.timeouts += np.bincount(
+            x, weights=timeouts, minlength=self.width
+        ).astype(np.int64)
+
+    def add_cells(self, cells):
+        """
+        Count the pings of rollup cells, every histogram bucket at its
+        middle delay
+        """
+        rows, buckets = np.nonzero(cells.hist)
+        middles = np.sqrt(BUCKETS[:-1] * BUCKETS[1:])
+        self.add(
+            cells.times[rows],
+            middles[buckets],
+            weights=cells.hist[rows, buckets],
+            timeouts=np.zeros(len(rows)),
+        )
+        self.add(
+            cells.times,
+            np.full(len(cells), np.inf),
+            timeouts=cells.timeouts,
+        )
+
+    @property
+    def x_edges(self):
+        return pd.to_datetime(
+            np.linspace(self.start, self.end, self.width + 1).astype(np.int64)
+        )
+
+    @property
+    def x_centers(self):
+        edges = np.linspace(self.start, self.end, self.width + 1)
+        return pd.to_datetime(((edges[:-1] + edges[1:]) / 2).astype(np.int64))
+
+    @property
+    def y_centers(self):
+        """
+        log10(delay) at the middle of every row
+        """
+        edges = np.linspace(LOG_LOW, LOG_HIGH, self.height + 1)
+        return (edges[:-1] + edges[1:]) / 2
+
+    def levels(self):
+        """
+        The counts as one byte per pixel: 0 for no ping, else 1 to 255
+        along log10(count) up to the highest count
+        """
+        top = np.log10(max(self.counts.max(), 10))
+        levels = 1 + np.log10(np.maximum(self.counts, 1)) / top * 254
+        return np.where(self.counts > 0, levels, 0).astype(np.uint8)
+
+    @property
+    def timeout_times(self):
+        return self.x_centers[self.timeouts > 0]
+
+
+def load(arrays_path=store.ARRAYS_PATH, rollup_path=ROLLUP_PATH, target=0):
+    """
+    The pings (times, delays) and the hourly rollup of a target
+    """
+    times, delays = store.open_arrays(arrays_path, target)
+    return times, delays, Rollup.load(rollup_file(rollup_path, target))
+
+
+def tiered_density(
+    times,
+    delays,
+    cells,
+    width=WIDTH,
+    height=HEIGHT,
+    target=0,
+    minutes_path=tiers.MINUTES_PATH,
+    retention_path=tiers.RETENTION_PATH,
+):
+    """
+    The density of the whole history of a target from the coarsest tier
+    fine enough for width pixels: the hourly cells when a pixel is an
+    hour or wider, else the raw pings (times, delays), the minute cells
+    of the days compacted before them and the hourly cells of the days
+    whose minute cells expired
+    """
+    starts = [int(times[0])] if len(times) else []
+    ends = [int(times[-1]) + 1] if len(times) else []
+    if len(cells):
+        starts.append(int(cells.times[0]))
+        ends.append(int(cells.times[-1]) + cells.period)
+    if not starts:
+        return Density(times, delays, width, height)
+    start, end = min(starts), max(ends)
+    density = Density([], [], width, height, start, end)
+    if (end - start) / width >= HOUR:
+        density.add_cells(cells)
+        return density
+    retention = tiers.load_retention(retention_path)
+    raw = np.searchsorted(times, retention["raw_since"])
+    density.add(times[raw:], delays[raw:])
+    if retention["raw_since"]:
+        minutes = tiers.read_cells(
+            minutes_path, start=pd.Timestamp(start), target=target
+        )
+        density.add_cells(tiers.cells_before(minutes, retention["raw_since"]))
+        density.add_cells(
+            tiers.cells_before(cells, retention["minutes_since"])
+        )
+    return density
+
+
+def medians(cells):
+    """
+    The median delay per hour and per (weekday, hour), without Friday and
+    Saturday for the latter, as in ploting.py
+    """
+    per_hour = cells.summarize(["hour"])
+    per_day_hour = cells.where(~np.isin(cells.dayofweek, [4, 5])).summarize(
+        ["dayofweek", "hour"]
+    )
+    return per_hour, per_day_hour
+
+
+def write_png(density, file_name="ping.png"):
+    """
+    The density image with a log delay axis, as a PNG
+    """
+    from matplotlib.colors import LogNorm
+    from matplotlib.dates import date2num
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import FuncFormatter
+
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    x0, x1 = date2num(density.x_edges[[0, -1]].to_pydatetime())
+    # the image rows are evenly spaced in log10(delay), so the y axis is
+    # linear in log10(delay) and labelled with the delays
+    ax.imshow(
+        np.ma.masked_equal(density.counts, 0),
+        extent=(x0, x1, LOG_LOW, LOG_HIGH),
+        origin="lower",
+        aspect="auto",
+        interpolation="nearest",
+        norm=LogNorm(vmin=1, vmax=max(density.counts.max(), 1)),
+        cmap="viridis",
+    )
+    ax.yaxis.set_major_formatter(FuncFormatter(lambda y, _: f"{10**y:g}"))
+    ax.scatter(
+        date2num(density.timeout_times.to_pydatetime()),
+        [np.log10(TIMEOUT_DELAY)] * int((density.timeouts > 0).sum()),
+        marker="x",
+        color="red",
+        s=12,
+    )
+    ax.xaxis_date()
+    ax.set(title="Ping", xlabel="time", ylabel="delay")
+    fig.savefig(file_name)
+
+
+def plotly_figure(density, cells):
+    """
+    The density, the median bar and the weekday heatmap as one Plotly
+    figure
+    """
+    import plotly.graph_objects as go
+    from plotly.colors import sequential
+    from plotly.subplots import make_subplots
+
+    # empty pixels are transparent
+    viridis = sequential.Viridis
+    colorscale = [[0, "rgba(0,0,0,0)"]] + [
+        [(1 + i * 254 / (len(viridis) - 1)) / 255, color]
+        for i, color in enumerate(viridis)
+    ]
+
+    per_hour, per_day_hour = medians(cells)
+    heatmap = per_day_hour.set_index(["dayofweek", "hour"])["delay"].unstack()
+
+    fig = make_subplots(
+        rows=3, cols=1, shared_xaxes=False, vertical_spacing=0.1
+    )
+    fig.add_trace(
+        go.Heatmap(
+            x=density.x_centers,
+            y=density.y_centers,
+            z=density.levels(),
+            zmin=0,
+            zmax=255,
+            colorscale=colorscale,
+            showscale=False,
+            hoverinfo="skip",
+        ),
+        row=1,
+        col=1,
+    )
+    fig.add_trace(
+        go.Scatter(
+            x=density.timeout_times,
+            y=[np.log10(TIMEOUT_DELAY)] * int((density.timeouts > 0).sum()),
+            mode="markers",
+            marker=dict(color="red", symbol="x"),
+        ),
+        row=1,
+        col=1,
+    )
+    fig.add_trace(
+        go.Bar(
+            x=per_hour["hour"], y=per_hour["delay"], marker_color="darkgreen"
+        ),
+        row=2,
+        col=1,
+    )
+    fig.add_trace(
+        go.Heatmap(
+            x=heatmap.columns,
+            y=[DAY_NAMES[d] for d in heatmap.index],
+            z=heatmap.values,
+            autocolorscale=False,
+            colorscale="YlOrRd",
+            coloraxis="coloraxis",
+        ),
+        row=3,
+        col=1,
+    )
+
+    fig.update_layout(height=900, title_text="Ping Analysis Dashboard")
+    # like the PNG, the density y axis is linear in log10(delay)
+    fig.update_layout(yaxis2_type="log")
+    fig.update_yaxes(
+        title_text="Ping Delay (log scale)",
+        tickvals=np.arange(np.ceil(LOG_LOW), LOG_HIGH + 1),
+        ticktext=[
+            f"{10**k:g}" for k in np.arange(np.ceil(LOG_LOW), LOG_HIGH + 1)
+        ],
+        row=1,
+        col=1,
+    )
+    fig.update_yaxes(title_text="Median Delay (log scale)", row=2, col=1)
+    fig.update_xaxes(title_text="Time", row=1, col=1)
+    fig.update_xaxes(title_text="Hour of the Day", row=2, col=1, dtick=1)
+    fig.update_yaxes(title_text="Day of Week", row=3, col=1, dtick=1)
+    fig.update_xaxes(title_text="Hour of the Day", row=3, col=1, dtick=1)
+    fig.update_traces(showlegend=False)
+    fig.update_coloraxes(showscale=False)
+    fig.layout.template = "plotly_dark"
+    return fig
+
+
+def render(out=".", width=WIDTH, height=HEIGHT, png=True, html=True, target=0):
+    """
+    Load the pings of a target once and write every artifact of the
+    report to out, returns the names of the files written
+    """
+    times, delays, cells = load(target=target)
+    density = tiered_density(times, delays, cells, width, height, target)
+    os.makedirs(out, exist_ok=True)
+    written = []
+    if png:
+        written.append(os.path.join(out, "ping.png"))
+        write_png(density, written[-1])
+    if html:
+        fig = plotly_figure(density, cells)
+        written.append(os.path.join(out, "pings.html"))
+        fig.write_html(written[-1])
+        written.append(os.path.join(out, "pings_online.html"))
+        fig.write_html(written[-1], include_plotlyjs="cdn")
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default=".")
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--no-png", action="store_true")
+    parser.add_argument("--no-html", action="store_true")
+    parser.add_argument("--target", default=store.DEFAULT_TARGET)
+    args = parser.parse_args()
+
+    for file_name in render(
+        args.out,
+        args.width,
+        args.height,
+        png=not args.no_png,
+        html=not args.no_html,
+        target=store.target_code(args.target),
+    ):
+        print(file_name)
@@ -0,0 +1,360 @@
+"""
+Per-hour rollup of the pings
+
+Every hour of every day is summarized in one cell holding the number of
+pings, the number of timeouts, the sum, min and max of the delays and a
+histogram of the delays over fixed log-spaced buckets. Cells of any set
+of hours can be merged by adding them up, so the per-hour and
+per-weekday medians of the dashboard are read from at most 24 cells per
+day instead of from the raw pings. Every target has its own rollup file.
+
+The same cells at another period (one minute for the minute tier of
+tiers.py) are a Rollup with that period.
+"""
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+ROLLUP_PATH = "pings.rollup.npz"
+
+# delays between 0.1ms and 10s, every bucket 5% wider than the previous,
+# so a quantile read from the histogram is within a few percent of the
+# exact one
+BUCKETS = np.geomspace(0.1, 10_000, 237)
+N_BUCKETS = len(BUCKETS) - 1
+
+HOUR = 3600 * 10**9
+MINUTE = 60 * 10**9
+
+
+def bucket_of(delays):
+    """
+    the histogram bucket of every (finite) delay
+    """
+    return np.clip(
+        np.searchsorted(BUCKETS, delays, side="right") - 1,
+        0,
+        N_BUCKETS - 1,
+    )
+
+
+class Rollup:
+    """
+    Cells of hourly statistics, sorted by hour.
+    hours are epoch hours (hours since 1970-01-01 00:00), or the epoch
+    number of the cell for another period (ns).
+    """
+
+    FIELDS = ("hours", "count", "timeouts", "total", "low", "high", "hist")
+
+    def __init__(
+        self, hours, count, timeouts, total, low, high, hist, period=HOUR
+    ):
+        self.hours = hours
+        self.count = count
+        self.timeouts = timeouts
+        self.total = total
+        self.low = low
+        self.high = high
+        self.hist = hist
+        self.period = period
+
+    def __len__(self):
+        return len(self.hours)
+
+    @classmethod
+    def empty(cls, period=HOUR):
+        return cls(
+            np.empty(0, np.int64),
+            np.empty(0, np.int64),
+            np.empty(0, np.int64),
+            np.empty(0, np.float64),
+            np.empty(0, np.float64),
+            np.empty(0, np.float64),
+            np.empty((0, N_BUCKETS), np.int32),
+            period,
+        )
+
+    @classmethod
+    def from_pings(cls, df, period=HOUR):
+        """
+        Summarize a (time, delay) frame
+        """
+        times = pd.to_datetime(df["time"]).to_numpy("datetime64[ns]")
+        delays = df["delay"].to_numpy(np.float64)
+        return cls.from_arrays(times.view(np.int64), delays, period)
+
+    @classmethod
+    def from_arrays(cls, times, delays, period=HOUR):
+        """
+        Summarize epoch-ns times and their delays (inf for a timeout)
+        """
+        hours, inverse = np.unique(times // period, return_inverse=True)
+        n = len(hours)
+        # NaN is a reply whose delay is unknown, it is counted but has no
+        # delay statistics
+        replied = np.isfinite(delays)
+        good = inverse[replied]
+        good_delays = delays[replied]
+
+        count = np.bincount(inverse, minlength=n)
+        timeouts = np.bincount(inverse[np.isinf(delays)], minlength=n)
+        total = np.bincount(good, weights=good_delays, minlength=n)
+        low = np.full(n, np.inf)
+        np.minimum.at(low, good, good_delays)
+        high = np.full(n, -np.inf)
+        np.maximum.at(high, good, good_delays)
+        hist = np.zeros((n, N_BUCKETS), np.int32)
+        np.add.at(hist, (good, bucket_of(good_delays)), 1)
+
+        return cls(hours, count, timeouts, total, low, high, hist, period)
+
+    def merge(self, other):
+        """
+        A rollup of the pings of both rollups
+        """
+        hours, inverse = np.unique(
+            np.concatenate([self.hours, other.hours]), return_inverse=True
+        )
+        return self._combine(
+            hours,
+            inverse,
+            [
+                np.concatenate([getattr(self, f), getattr(other, f)])
+                for f in self.FIELDS[1:]
+            ],
+            self.period,
+        )
+
+    def coarsen(self, period=HOUR):
+        """
+        The cells merged into cells of a longer period
+        """
+        hours, inverse = np.unique(
+            self.hours * self.period // period, return_inverse=True
+        )
+        return self._combine(
+            hours, inverse, [getattr(self, f) for f in self.FIELDS[1:]], period
+        )
+
+    @classmethod
+    def _combine(cls, hours, inverse, fields, period=HOUR):
+        count, timeouts, total, low, high, hist = fields
+        n = len(hours)
+        merged_low = np.full(n, np.inf)
+        np.minimum.at(merged_low, inverse, low)
+        merged_high = np.full(n, -np.inf)
+        np.maximum.at(merged_high, inverse, high)
+        merged_hist = np.zeros((n, hist.shape[1]), np.int32)
+        np.add.at(merged_hist, inverse, hist)
+        return cls(
+            hours,
+            np.bincount(inverse, weights=count, minlength=n).astype(np.int64),
+            np.bincount(inverse, weights=timeouts, minlength=n).astype(
+                np.int64
+            ),
+            np.bincount(inverse, weights=total, minlength=n),
+            merged_low,
+            merged_high,
+            merged_hist,
+            period,
+        )
+
+    def where(self, mask):
+        return Rollup(
+            *(getattr(self, f)[mask] for f in self.FIELDS), self.period
+        )
+
+    def select(self, start, end):
+        """
+        The cells of the hours between start and end
+        """
+        lo = np.searchsorted(
+            self.hours, pd.Timestamp(start).value // self.period, side="left"
+        )
+        hi = np.searchsorted(
+            self.hours, pd.Timestamp(end).value // self.period, side="right"
+        )
+        return self.where(slice(lo, hi))
+
+    @property
+    def times(self):
+        """
+        The start of every cell, epoch ns
+        """
+        return self.hours * self.period
+
+    @property
+    def epoch_hours(self):
+        return self.times // HOUR
+
+    @property
+    def hour_of_day(self):
+        return self.epoch_hours % 24
+
+    @property
+    def dayofweek(self):
+        # 1970-01-01 was a Thursday
+        return (self.epoch_hours // 24 + 3) % 7
+
+    @property
+    def day(self):
+        return self.epoch_hours // 24
+
+    def summarize(self, by, q=0.5):
+        """
+        Merge the cells that share the keys in by (any of "hour",
+        "dayofweek" and "day") and return a frame with the keys, count,
+        timeouts, loss_rate, mean, min, max and the q quantile ("delay")
+        per group
+        """
+        keys = {
+            "hour": self.hour_of_day,
+            "dayofweek": self.dayofweek,
+            "day": self.day,
+        }
+        groups, inverse = np.unique(
+            np.stack([keys[k] for k in by]).reshape(len(by), -1),
+            axis=1,
+            return_inverse=True,
+        )
+        merged = self._combine(
+            np.arange(groups.shape[1]),
+            inverse.reshape(-1),
+            [getattr(self, f) for f in self.FIELDS[1:]],
+        )
+        replies = merged.hist.sum(axis=1)
+        df = pd.DataFrame(dict(zip(by, groups)))
+        if "day" in df:
+            df["day"] = df["day"].to_numpy().astype("datetime64[D]")
+        df["count"] = merged.count
+        df["timeouts"] = merged.timeouts
+        with np.errstate(invalid="ignore", divide="ignore"):
+            df["loss_rate"] = merged.timeouts / merged.count
+            df["mean"] = merged.total / replies
+        df["min"] = merged.low
+        df["max"] = merged.high
+        df["delay"] = merged.quantile(q)
+        return df
+
+    def quantile(self, q):
+        """
+        The q quantile of the delays of every cell, interpolated inside
+        the histogram bucket it falls in and clipped to the cell's min
+        and max
+        """
+        cumulative = self.hist.cumsum(axis=1)
+        n = cumulative[:, -1]
+        target = q * n
+        bucket = np.minimum(
+            (cumulative < target[:, None]).sum(axis=1), N_BUCKETS - 1
+        )
+        rows = np.arange(len(bucket))
+        in_bucket = self.hist[rows, bucket]
+        before = cumulative[rows, bucket] - in_bucket
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fraction = np.clip((target - before) / in_bucket, 0, 1)
+            values = BUCKETS[bucket] * (
+                BUCKETS[bucket + 1] / BUCKETS[bucket]
+            ) ** np.nan_to_num(fraction)
+            values = np.clip(values, self.low, self.high)
+        values[n == 0] = np.nan
+        return values
+
+    def save(self, path=ROLLUP_PATH):
+        tmp_file = path + ".tmp.npz"
+        np.savez(
+            tmp_file,
+            period=self.period,
+            **{f: getattr(self, f) for f in self.FIELDS},
+        )
+        os.replace(tmp_file, path)
+
+    @classmethod
+    @metrics.timed("store_read", store="rollup")
+    def load(cls, path=ROLLUP_PATH):
+        if not os.path.exists(path):
+            return cls.empty()
+        with np.load(path) as f:
+            # rollups saved before there were periods are hourly
+            period = int(f["period"]) if "period" in f else HOUR
+            return cls(*(f[name] for name in cls.FIELDS), period)
+
+
+def target_groups(df):
+    """
+    (target code, pings) of every target in df; a frame without a target
+    column holds the pings of target 0
+    """
+    if "target" not in df:
+        return [(0, df)]
+    return df.groupby(df["target"].to_numpy(), sort=True)
+
+
+def rollup_file(path, target=0):
+    """
+    The rollup of a target: path for target 0, which is where the rollup
+    was before there were targets, and path with the code before .npz
+    for the others
+    """
+    if not target:
+        return path
+    base, extension = os.path.splitext(path)
+    return f"{base}.{target}{extension}"
+
+
+def rollup_files(path=ROLLUP_PATH):
+    """
+    The rollup files of all the targets
+    """
+    base, extension = os.path.splitext(path)
+    files = [
+        file_name
+        for file_name in glob.glob(f"{glob.escape(base)}.*{extension}")
+        if file_name.split(".")[-2].isdigit()
+    ]
+    return ([path] if os.path.exists(path) else []) + sorted(files)
+
+
+def write_rollup(df, path=ROLLUP_PATH, keep_before=0):
+    """
+    Replace the rollups with the ones of the pings in df. The cells of
+    the hours before keep_before (epoch ns, the hours whose raw pings
+    were compacted away, see tiers.py) are kept.
+    """
+    kept = {}
+    for file_name in rollup_files(path) if keep_before else []:
+        cells = Rollup.load(file_name)
+        kept[file_name] = cells.where(cells.times < keep_before)
+    written = set()
+    for target, group in target_groups(df):
+        file_name = rollup_file(path, target)
+        cells = Rollup.from_pings(group)
+        if file_name in kept:
+            cells = kept[file_name].merge(cells)
+        cells.save(file_name)
+        written.add(file_name)
+    for file_name in rollup_files(path):
+        if file_name in kept and file_name not in written:
+            kept[file_name].save(file_name)
+        elif file_name not in written and file_name != path:
+            os.remove(file_name)
+    if rollup_file(path) not in written and path not in kept:
+        Rollup.empty().save(path)
+
+
+def update_rollup(df, path=ROLLUP_PATH):
+    """
+    Add the pings in df to the saved rollups
+    """
+    for target, group in target_groups(df):
+        if len(group):
+            file_name = rollup_file(path, target)
+            Rollup.load(file_name).merge(Rollup.from_pings(group)).save(
+                file_name
+            )
@@ -0,0 +1,503 @@
+"""
+Columnar storage of the pings
+
+The pings are kept as a directory of Parquet files partitioned by day:
+
+    pings.parquet/day=2023-05-01/part-0.parquet
+    pings.parquet/day=2023-05-02/part-0.parquet
+    ...
+
+time is stored as timestamp[ns], delay as float32 (timeouts stay inf)
+and status as uint8 (the OK/TIMEOUT/ERROR codes of records.py), so
+readers get typed columns back without parsing any text, and a date
+range only opens the partitions of the days it covers. Partitions
+written before status existed get it derived from delay when read.
+
+Every ping has a target (the probed host), stored as a uint16 code: the
+position of its name in the JSON list in pings.targets. In a day file
+the rows are sorted by target and then by time, and every target is its
+own row group, so reading one target skips the row groups of the others.
+
+For the dashboard the same pings are also kept as two flat arrays per
+target,
+
+    pings.bin/time.i64            target 0, sorted epoch nanoseconds
+    pings.bin/delay.f32           target 0, delays, float32
+    pings.bin/target=3/time.i64   target 3
+    ...
+
+which are opened with numpy.memmap, so every worker process reads them
+through the shared page cache instead of holding its own DataFrame, and
+the range of a target is one contiguous slice of its own arrays.
+Target 0 (8.8.8.8, the target of pinger.sh) stays where the arrays were
+before there were targets, so older stores read as target 0.
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import metrics
+import rollup
+from records import add_names, load_names, status_codes, status_of
+
+STORE_PATH = "pings.parquet"
+ARRAYS_PATH = "pings.bin"
+VERSION_PATH = "pings.version"
+TARGETS_PATH = "pings.targets"
+
+# the target of the pings of stores and logs that do not name one
+DEFAULT_TARGET = "8.8.8.8"
+
+SCHEMA = pa.schema(
+    [
+        ("time", pa.timestamp("ns")),
+        ("delay", pa.float32()),
+        ("status", pa.uint8()),
+        ("target", pa.uint16()),
+    ]
+)
+PARTITIONING = ds.partitioning(
+    pa.schema([("day", pa.string())]), flavor="hive"
+)
+
+
+def load_targets(path=TARGETS_PATH):
+    """
+    The target names, by code
+    """
+    return load_names(path) or [DEFAULT_TARGET]
+
+
+def encode_targets(df, path=TARGETS_PATH):
+    """
+    df with the target names replaced by their codes, new names get new
+    codes
+    """
+    if "target" not in df or pd.api.types.is_integer_dtype(df["target"]):
+        return df
+    names = df["target"].astype(str)
+    codes = add_names(path, names.unique(), first=[DEFAULT_TARGET])
+    return df.assign(target=names.map(codes).to_numpy(np.uint16))
+
+
+def target_code(name, path=TARGETS_PATH):
+    """
+    The code of a target name
+    """
+    targets = load_targets(path)
+    if name not in targets:
+        raise ValueError(f"unknown target {name}, known: {targets}")
+    return targets.index(name)
+
+
+def day_file(path, day):
+    return os.path.join(path, f"day={day}", "part-0.parquet")
+
+
+def to_table(df):
+    """
+    convert a (time, delay[, status][, target code]) frame to a table
+    with the store schema
+    """
+    return pa.table(
+        {
+            "time": pd.to_datetime(df["time"]).to_numpy("datetime64[ns]"),
+            "delay": df["delay"].to_numpy(np.float32),
+            "status": status_codes(df),
+            "target": (
+                df["target"].to_numpy(np.uint16)
+                if "target" in df
+                else np.zeros(len(df), np.uint16)
+            ),
+        },
+        schema=SCHEMA,
+    )
+
+
+def fill_missing(table):
+    """
+    fill in the columns of the rows of old partitions that have none: the
+    status is derived from delay, the target is 0
+    """
+    for name in ("status", "target"):
+        if name not in table.column_names:
+            continue
+        column = table[name]
+        if column.null_count == 0:
+            continue
+        if name == "status" and "delay" in table.column_names:
+            filled = status_of(table["delay"].to_numpy())
+        else:
+            filled = np.zeros(len(table), np.uint8)
+        table = table.set_column(
+            table.column_names.index(name),
+            name,
+            pc.if_else(
+                pc.is_null(column), pa.array(filled).cast(column.type), column
+            ),
+        )
+    return table
+
+
+def write_day(table, file_name):
+    """
+    Write the pings (or other rows with a target and a time) of a day
+    sorted by target and time, one row group per target
+    """
+    table = table.sort_by([("target", "ascending"), ("time", "ascending")])
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    tmp_file = file_name + ".tmp"
+    with pq.ParquetWriter(tmp_file, table.schema) as writer:
+        for target in pc.unique(table["target"]).to_pylist():
+            writer.write_table(table.filter(pc.equal(table["target"], target)))
+    os.replace(tmp_file, file_name)
+
+
+def append_pings(df, path=STORE_PATH):
+    """
+    Add pings to the store.
+    Only the partitions of the days present in df are rewritten.
+    """
+    if len(df) == 0:
+        return
+    df = df[[c for c in SCHEMA.names if c in df]]
+    days = pd.to_datetime(df["time"]).dt.strftime("%Y-%m-%d")
+    for day, group in df.groupby(days.to_numpy()):
+        file_name = day_file(path, day)
+        table = to_table(group)
+        if os.path.exists(file_name):
+            table = pa.concat_tables(
+                [fill_missing(pq.read_table(file_name, schema=SCHEMA)), table]
+            )
+        write_day(table, file_name)
+
+
+def days(path=STORE_PATH):
+    """
+    The days of the partitions of the store, oldest first
+    """
+    if not os.path.isdir(path):
+        return []
+    return sorted(
+        name[4:] for name in os.listdir(path) if name.startswith("day=")
+    )
+
+
+def drop_days(path, days):
+    """
+    Remove the partitions of days from the store
+    """
+    for day in days:
+        shutil.rmtree(os.path.dirname(day_file(path, day)))
+
+
+def write_pings(df, path=STORE_PATH):
+    """
+    Replace the whole store with df
+    """
+    shutil.rmtree(path, ignore_errors=True)
+    append_pings(df, path)
+
+
+@metrics.timed("store_read", store="parquet")
+def read_pings(
+    path=STORE_PATH,
+    start=None,
+    end=None,
+    columns=("time", "delay", "status"),
+    targets=None,
+):
+    """
+    Read the pings between start and end (inclusive, either may be None)
+    of the target codes in targets (None for all of them).
+    Only the partitions of the days in range, the row groups of the
+    targets and the requested columns are read.
+    """
+    if not os.path.isdir(path):
+        return pd.DataFrame(
+            {
+                c: pd.Series(dtype=SCHEMA.field(c).type.to_pandas_dtype())
+                for c in columns
+            }
+        )
+    dataset = ds.dataset(
+        path,
+        format="parquet",
+        schema=SCHEMA.append(pa.field("day", pa.string())),
+        partitioning=PARTITIONING,
+    )
+    conditions = []
+    if start is not None:
+        start = pd.Timestamp(start)
+        conditions.append(ds.field("day") >= start.strftime("%Y-%m-%d"))
+        conditions.append(ds.field("time") >= start)
+    if end is not None:
+        end = pd.Timestamp(end)
+        conditions.append(ds.field("day") <= end.strftime("%Y-%m-%d"))
+        conditions.append(ds.field("time") <= end)
+    if targets is not None:
+        targets = [int(t) for t in targets]
+        condition = ds.field("target").isin(targets)
+        if 0 in targets:
+            # partitions written before there were targets
+            condition = condition | ds.field("target").is_null()
+        conditions.append(condition)
+    condition = None
+    for c in conditions:
+        condition = c if condition is None else condition & c
+    read_columns = list(columns)
+    if "status" in columns and "delay" not in columns:
+        # old partitions derive the status from the delay
+        read_columns.append("delay")
+    table = fill_missing(
+        dataset.to_table(columns=read_columns, filter=condition)
+    ).select(list(columns))
+    if "time" in columns:
+        keys = [("time", "ascending")]
+        if "target" in columns:
+            keys.insert(0, ("target", "ascending"))
+        table = table.sort_by(keys)
+    return table.to_pandas()
+
+
+def arrays_dir(path=ARRAYS_PATH, target=0):
+    """
+    The array store of a target: path for target 0, path/target=<code>
+    for the others
+    """
+    return path if not target else os.path.join(path, f"target={target}")
+
+
+def array_targets(path=ARRAYS_PATH):
+    """
+    The codes of the targets that have arrays
+    """
+    targets = [0] if os.path.exists(array_files(path)[0]) else []
+    for name in sorted(os.listdir(path)) if os.path.isdir(path) else []:
+        if name.startswith("target=") and name[7:].isdigit():
+            targets.append(int(name[7:]))
+    return sorted(targets)
+
+
+def array_files(path):
+    return os.path.join(path, "time.i64"), os.path.join(path, "delay.f32")
+
+
+@metrics.timed("store_read", store="arrays")
+def open_arrays(path=ARRAYS_PATH, target=0):
+    """
+    Map the array store of a target read-only, returns (times, delays)
+    where times are int64 epoch nanoseconds
+    """
+    arrays = []
+    for file_name, dtype in zip(
+        array_files(arrays_dir(path, target)), (np.int64, np.float32)
+    ):
+        if not os.path.exists(file_name) or os.path.getsize(file_name) == 0:
+            arrays.append(np.empty(0, dtype=dtype))
+        else:
+            arrays.append(np.memmap(file_name, dtype=dtype, mode="r"))
+    n = min(len(a) for a in arrays)
+    return arrays[0][:n], arrays[1][:n]
+
+
+def stored(df, path=ARRAYS_PATH):
+    """
+    Which pings of df (with target codes) the array store already has, a
+    ping is the same when its target and its time are
+    """
+    seen = np.zeros(len(df), dtype=bool)
+    targets = df["target"].to_numpy()
+    times = df["time"].to_numpy().view(np.int64)
+    for target in np.unique(targets):
+        stored_times, _ = open_arrays(path, int(target))
+        rows = np.flatnonzero(targets == target)
+        at = np.searchsorted(stored_times, times[rows])
+        found = at < len(stored_times)
+        found[found] = stored_times[at[found]] == times[rows][found]
+        seen[rows] = found
+    return seen
+
+
+def write_target_arrays(df, path):
+    df = df.sort_values("time", kind="stable")
+    times = pd.to_datetime(df["time"]).to_numpy("datetime64[ns]")
+    os.makedirs(path, exist_ok=True)
+    for file_name, values in zip(
+        array_files(path),
+        (times.view(np.int64), df["delay"].to_numpy(np.float32)),
+    ):
+        tmp_file = file_name + ".tmp"
+        values.tofile(tmp_file)
+        os.replace(tmp_file, file_name)
+
+
+def write_arrays(df, path=ARRAYS_PATH):
+    """
+    Replace the array store with the pings in df
+    """
+    written = set()
+    for target, group in rollup.target_groups(df):
+        write_target_arrays(group, arrays_dir(path, target))
+        written.add(int(target))
+    for target in array_targets(path):
+        if target and target not in written:
+            shutil.rmtree(arrays_dir(path, target))
+    if 0 not in written:
+        write_target_arrays(df.iloc[:0], path)
+
+
+def merge_sorted(old, new):
+    """
+    Merge the (times, values) arrays of new, sorted by time, into the ones
+    of old in one pass; new pings go after the old ones of the same time
+    """
+    old_times, old_values = old
+    new_times, new_values = new
+    at = np.searchsorted(old_times, new_times, side="right")
+    at += np.arange(len(new_times))
+    is_new = np.zeros(len(old_times) + len(new_times), dtype=bool)
+    is_new[at] = True
+    merged = []
+    for old_array, new_array in zip(old, new):
+        array = np.empty(len(is_new), dtype=old_array.dtype)
+        array[is_new] = new_array
+        array[~is_new] = old_array
+        merged.append(array)
+    return merged
+
+
+def append_arrays(df, path=ARRAYS_PATH):
+    """
+    Add pings to the array store. Pings of a target newer than everything
+    stored for it are appended to the end of its files, otherwise they
+    are merged into its files, which are rewritten.
+    """
+    for target, group in rollup.target_groups(df):
+        if len(group) == 0:
+            continue
+        target_path = arrays_dir(path, target)
+        group = group.sort_values("time", kind="stable")
+        times = pd.to_datetime(group["time"]).to_numpy("datetime64[ns]")
+        stored_times, stored_delays = open_arrays(target_path)
+        if len(stored_times) and times[0].view(np.int64) < stored_times[-1]:
+            merged_times, merged_delays = merge_sorted(
+                (stored_times, stored_delays),
+                (times.view(np.int64), group["delay"].to_numpy(np.float32)),
+            )
+            for file_name, values in zip(
+                array_files(target_path), (merged_times, merged_delays)
+            ):
+                tmp_file = file_name + ".tmp"
+                values.tofile(tmp_file)
+                os.replace(tmp_file, file_name)
+            continue
+        os.makedirs(target_path, exist_ok=True)
+        for file_name, values in zip(
+            array_files(target_path),
+            (times.view(np.int64), group["delay"].to_numpy(np.float32)),
+        ):
+            with open(file_name, "ab") as f:
+                values.tofile(f)
+
+
+def trim_arrays(path=ARRAYS_PATH, before=None):
+    """
+    Drop the pings before the epoch ns before from the arrays of every
+    target, returns the number dropped
+    """
+    dropped = 0
+    for target in array_targets(path):
+        target_path = arrays_dir(path, target)
+        times, delays = open_arrays(target_path)
+        n = int(np.searchsorted(times, before, side="left"))
+        if n == 0:
+            continue
+        for file_name, values in zip(
+            array_files(target_path), (times[n:], delays[n:])
+        ):
+            tmp_file = file_name + ".tmp"
+            np.asarray(values).tofile(tmp_file)
+            os.replace(tmp_file, file_name)
+        dropped += n
+    return dropped
+
+
+def data_version(path=VERSION_PATH):
+    """
+    A number that ingest increases every time it changes the stores
+    """
+    try:
+        with open(path, "r") as f:
+            return int(f.read())
+    except FileNotFoundError:
+        return 0
+
+
+def bump_version(path=VERSION_PATH):
+    version = data_version(path) + 1
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w") as f:
+        f.write(str(version))
+    os.replace(tmp_file, path)
+    return version
+
+
+def add_pings(df, root=""):
+    """
+    Append pings to the Parquet store, the array store and the rollup in
+    the directory root, and bump its data version. The targets of df may
+    be names, which get their codes from the target list of root.
+    """
+    if len(df) == 0:
+        return
+    os.makedirs(root or ".", exist_ok=True)
+    df = encode_targets(df, os.path.join(root, TARGETS_PATH))
+    append_pings(df, os.path.join(root, STORE_PATH))
+    append_arrays(df, os.path.join(root, ARRAYS_PATH))
+    rollup.update_rollup(df, os.path.join(root, rollup.ROLLUP_PATH))
+    bump_version(os.path.join(root, VERSION_PATH))
+
+
+def replace_pings(df, root=""):
+    """
+    Replace the Parquet store, the array store and the rollup in the
+    directory root with df, and bump its data version
+    """
+    os.makedirs(root or ".", exist_ok=True)
+    df = encode_targets(df, os.path.join(root, TARGETS_PATH))
+    write_pings(df, os.path.join(root, STORE_PATH))
+    write_arrays(df, os.path.join(root, ARRAYS_PATH))
+    rollup.write_rollup(df, os.path.join(root, rollup.ROLLUP_PATH))
+    bump_version(os.path.join(root, VERSION_PATH))
+
+
+def migrate_csv(
+    csv_file="pings.csv",
+    path=STORE_PATH,
+    arrays_path=ARRAYS_PATH,
+    rollup_path=rollup.ROLLUP_PATH,
+    version_path=VERSION_PATH,
+):
+    """
+    Build the store from a pings.csv written by an older analysis.py
+    """
+    with metrics.timer("csv_load"):
+        df = pd.read_csv(csv_file, usecols=["time", "delay"])
+    df["time"] = pd.to_datetime(df["time"])
+    write_pings(df, path)
+    write_arrays(df, arrays_path)
+    rollup.write_rollup(df, rollup_path)
+    bump_version(version_path)
+    return len(df)
+
+
+if __name__ == "__main__":
+    print(f"Migrated {migrate_csv()} pings to {STORE_PATH}")
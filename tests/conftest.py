@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import synthetic  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    """
+    Every test runs in its own directory, where the default store paths
+    point
+    """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def write_log(file_name, n, start="2023-01-01", host="8.8.8.8", seed=0):
+    """
+    Write a pinger.sh log of n samples, one a minute from start, to host,
+    returns its bytes
+    """
+    synthetic.write_log(
+        file_name, n, corrupt_rate=0, seed=seed, start=start, interval=60
+    )
+    with open(file_name, "rb") as f:
+        data = f.read().replace(b"8.8.8.8", host.encode())
+    with open(file_name, "wb") as f:
+        f.write(data)
+    return data
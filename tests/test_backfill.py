@@ -0,0 +1,13 @@
+import backfill
+import store
+import tiers
+from conftest import write_log
+
+
+def test_backfill_twice_adds_nothing():
+    write_log("old.log", 500)
+    df = backfill.backfill(["old.log"], workers=1, chunk_size=16 << 10)
+
+    assert tiers.add_new_pings(df[["time", "target", "delay"]]) == 500
+    assert tiers.add_new_pings(df[["time", "target", "delay"]]) == 0
+    assert len(store.read_pings()) == 500
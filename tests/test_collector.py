@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+
+import collector
+import store
+from conftest import write_log
+
+
+def batch(times, node="node", host="8.8.8.8"):
+    return {
+        "node": node,
+        "time": [pd.Timestamp(t).value for t in times],
+        "target": [host] * len(times),
+        "delay": [10.0] * len(times),
+        "status": [0] * len(times),
+    }
+
+
+def stored_pings(root):
+    return store.read_pings(
+        f"{root}/{store.STORE_PATH}", columns=("time", "target")
+    )
+
+
+def test_push_resumes_and_sees_truncation():
+    server, c, url = collector.stand_in("collected")
+    try:
+        write_log("pinger.log", 100)
+        assert collector.push(url, "node") == 100
+        assert collector.push(url, "node") == 0
+
+        with open("pinger.log", "ab") as f:
+            f.write(write_log("more.log", 10, start="2023-01-02"))
+        assert collector.push(url, "node") == 10
+
+        # truncated in place and written again past the saved offset
+        data = write_log("new.log", 200, start="2023-01-03", seed=1)
+        with open("pinger.log", "r+b") as f:
+            f.truncate(0)
+            f.write(data)
+        assert collector.push(url, "node") == 200
+
+        c.flush()
+        assert len(stored_pings("collected")) == 310
+    finally:
+        server.shutdown()
+
+
+def test_merge_keeps_nodes_apart_and_drops_repeated_pings():
+    c = collector.Collector("collected")
+    c.receive(batch(["2023-01-01 00:02", "2023-01-01 00:00"]))
+    # sent again because its answer was lost, with one more ping
+    c.receive(batch(["2023-01-01 00:00", "2023-01-01 00:01"]))
+    c.receive(batch(["2023-01-01 00:00"], node="other"))
+    assert c.flush() == 4
+
+    c.receive(batch(["2023-01-01 00:01", "2023-01-01 00:03"]))
+    assert c.flush() == 1
+
+    names = store.load_targets(f"collected/{store.TARGETS_PATH}")
+    targets = stored_pings("collected")["target"].map(names.__getitem__)
+    assert targets.value_counts().to_dict() == {
+        "node/8.8.8.8": 4,
+        "other/8.8.8.8": 1,
+    }
+
+
+def test_a_failed_flush_keeps_the_runs(monkeypatch):
+    c = collector.Collector("collected")
+    c.receive(batch(["2023-01-01 00:00", "2023-01-01 00:01"]))
+    add_pings = store.add_pings
+
+    def fail(df, root):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "add_pings", fail)
+    with pytest.raises(OSError):
+        c.flush()
+    c.receive(batch(["2023-01-01 00:02"]))
+
+    monkeypatch.setattr(store, "add_pings", add_pings)
+    assert c.flush() == 3
+    assert c.flush() == 0
+    assert len(stored_pings("collected")) == 3
@@ -0,0 +1,73 @@
+import os
+
+import analysis
+import store
+from conftest import write_log
+
+
+def ingest(log_file="pinger.log", full=False):
+    df, _ = analysis.ingest(
+        log_file, store.STORE_PATH, "pings.state.json", full=full
+    )
+    return len(df)
+
+
+def stored():
+    return len(store.open_arrays()[0])
+
+
+def append(file_name, data):
+    with open(file_name, "ab") as f:
+        f.write(data)
+
+
+def test_resume_from_the_saved_offset():
+    write_log("pinger.log", 100)
+    assert ingest() == 100
+    assert ingest() == 0
+
+    append("pinger.log", write_log("more.log", 10, start="2023-01-02"))
+    assert ingest() == 10
+    assert stored() == 110
+
+
+def test_a_sample_cut_in_the_middle_is_read_once_whole():
+    write_log("pinger.log", 100)
+    ingest()
+    data = write_log("more.log", 10, start="2023-01-02")
+    # cut inside the reply line of the last sample
+    cut = data.rindex(b"time=") + 3
+    append("pinger.log", data[:cut])
+    assert ingest() == 9
+    append("pinger.log", data[cut:])
+    assert ingest() == 1
+    assert stored() == 110
+
+
+def test_truncated_and_written_again_past_the_offset():
+    write_log("pinger.log", 100)
+    ingest()
+    # same inode, shorter at first and then longer than the saved offset
+    data = write_log("new.log", 200, start="2023-01-02", seed=1)
+    with open("pinger.log", "r+b") as f:
+        f.truncate(0)
+        f.write(data)
+    assert ingest() == 200
+    assert stored() == 300
+
+
+def test_replaced_by_a_file_with_the_same_pings():
+    write_log("pinger.log", 100)
+    ingest()
+    # another file (inode) holding the pings already stored and new ones
+    write_log("new.log", 120)
+    os.replace("new.log", "pinger.log")
+    assert ingest() == 20
+    assert stored() == 120
+
+
+def test_full_ingest_starts_again():
+    write_log("pinger.log", 100)
+    ingest()
+    assert ingest(full=True) == 100
+    assert stored() == 100
@@ -0,0 +1,102 @@
+import gzip
+import lzma
+import os
+
+import pytest
+
+import analysis
+import logfiles
+import store
+from conftest import write_log
+
+DAY = 1440
+
+
+def ingest(log_file="pinger.log"):
+    df, _ = analysis.ingest(log_file, store.STORE_PATH, "pings.state.json")
+    return df
+
+
+def compress(file_name, extension):
+    """
+    Replace file_name by its compressed copy, returns the new name
+    """
+    with open(file_name, "rb") as f:
+        data = f.read()
+    if extension == ".gz":
+        data = gzip.compress(data)
+    elif extension == ".xz":
+        data = lzma.compress(data)
+    else:
+        zstandard = pytest.importorskip("zstandard")
+        data = zstandard.ZstdCompressor().compress(data)
+    with open(file_name + extension, "wb") as f:
+        f.write(data)
+    os.remove(file_name)
+    return file_name + extension
+
+
+@pytest.mark.parametrize("extension", [".gz", ".xz", ".zst"])
+def test_extent_of_a_compressed_log(extension):
+    data = write_log("pinger.log.1", 100)
+    file_name = compress("pinger.log.1", extension)
+    first, last, length = logfiles.extent(file_name, chunk_size=1000)
+    assert first == b"01/01/23-00:00:00"
+    assert last == b"01/01/23-01:39:00"
+    assert length == len(data)
+    with logfiles.open_log(file_name) as f:
+        assert f.read() == data
+
+
+def test_rotations_are_read_in_the_order_of_their_times():
+    # the names do not follow the times
+    write_log("pinger.log.3", 100, start="2023-01-02")
+    compress("pinger.log.3", ".xz")
+    write_log("pinger.log.2", 100, start="2023-01-01")
+    compress("pinger.log.2", ".gz")
+    write_log("pinger.log.1", 100, start="2023-01-03")
+    write_log("pinger.log", 100, start="2023-01-04")
+
+    df = ingest()
+
+    assert len(df) == 400
+    assert df["time"].is_monotonic_increasing
+    assert len(ingest()) == 0
+
+
+def test_rotated_and_compressed_logs_are_not_read_again():
+    write_log("pinger.log", DAY)
+    assert len(ingest()) == DAY
+
+    # logrotate: rename, start a new log, compress the old one later
+    os.rename("pinger.log", "pinger.log.1")
+    write_log("pinger.log", 100, start="2023-01-02")
+    assert len(ingest()) == 100
+    compress("pinger.log.1", ".gz")
+    assert len(ingest()) == 0
+
+    os.rename("pinger.log.1.gz", "pinger.log.2.gz")
+    os.rename("pinger.log", "pinger.log.1")
+    write_log("pinger.log", 10, start="2023-01-03")
+    assert len(ingest()) == 10
+    assert len(store.open_arrays()[0]) == DAY + 110
+
+
+def test_the_rest_of_a_log_rotated_away_is_read():
+    write_log("pinger.log", 100)
+    ingest()
+    with open("pinger.log", "ab") as f:
+        f.write(write_log("more.log", 10, start="2023-01-02"))
+    os.rename("pinger.log", "pinger.log.1")
+    write_log("pinger.log", 5, start="2023-01-03")
+    assert len(ingest()) == 15
+
+
+def test_a_glob_of_logs():
+    os.mkdir("logs")
+    write_log("logs/b.log", 100, start="2023-01-01")
+    write_log("logs/a.log", 100, start="2023-01-02")
+    compress("logs/a.log", ".gz")
+    df = ingest("logs/*.log*")
+    assert len(df) == 200
+    assert df["time"].is_monotonic_increasing
@@ -0,0 +1,60 @@
+import pytest
+
+import metrics
+
+parser = pytest.importorskip("prometheus_client.parser")
+
+
+@pytest.fixture(autouse=True)
+def empty():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_prometheus_text_parses():
+    metrics.count("bad_times", 3)
+    metrics.count("probes", target='a "b"', status="ok")
+    metrics.set_gauge("rows", 10)
+    metrics.observe("parse", 0.5, file="x")
+    metrics.observe("parse", 1.5, file="x")
+
+    families = {
+        family.name: family
+        for family in parser.text_string_to_metric_families(
+            metrics.prometheus_text()
+        )
+    }
+    # the parser names a counter family without its _total
+    assert {name: f.type for name, f in families.items()} == {
+        "pinger_bad_times": "counter",
+        "pinger_probes": "counter",
+        "pinger_rows": "gauge",
+        "pinger_parse_seconds": "summary",
+        "pinger_parse_seconds_max": "gauge",
+    }
+    for family in families.values():
+        assert family.samples
+    (probes,) = families["pinger_probes"].samples
+    assert probes.labels == {"target": 'a "b"', "status": "ok"}
+    assert probes.value == 1
+    summary = {
+        s.name: s.value for s in families["pinger_parse_seconds"].samples
+    }
+    assert summary == {
+        "pinger_parse_seconds_count": 2,
+        "pinger_parse_seconds_sum": 2.0,
+    }
+    assert families["pinger_parse_seconds_max"].samples[0].value == 1.5
+
+
+def test_every_sample_follows_its_type_line():
+    metrics.count("probes", status="ok")
+    metrics.observe("parse", 0.5)
+    family = None
+    for line in metrics.prometheus_text().splitlines():
+        if line.startswith("# TYPE "):
+            family = line.split()[2]
+        else:
+            name = line.split("{")[0].split()[0]
+            assert name in (family, family + "_count", family + "_sum")
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+
+import prober
+
+
+def test_failed_flush_is_resent_but_observed_once():
+    sent, observed = [], []
+
+    def sink(df):
+        if not sent:
+            sent.append(None)
+            raise OSError("disk full")
+        sent.append(df)
+
+    p = prober.Prober(
+        [], sink, timeout=0, flush_interval=0.05, observe=observed.append
+    )
+    old = time.time_ns() - 5 * 10**9
+    p.results = [(old + i, "a", 1.0, "ok", -1) for i in range(3)]
+
+    async def run():
+        task = asyncio.create_task(p.run(0.5))
+        await asyncio.sleep(0.12)
+        p.results.append((old + 3, "a", np.inf, "timeout", -1))
+        await task
+
+    asyncio.run(run())
+    sent = pd.concat(sent[1:])
+    assert sent["time"].astype("int64").tolist() == [old + i for i in range(4)]
+    assert sum(len(df) for df in observed) == 4
+
+
+def test_store_writer_keeps_what_pyarrow_rejects(monkeypatch):
+    def add_pings(df, path):
+        raise prober.pa.ArrowInvalid("bad column")
+
+    monkeypatch.setattr(prober.store, "add_pings", add_pings)
+    writer = prober.StoreWriter("probes", every=1e9)
+    df = pd.DataFrame(
+        {
+            "time": pd.to_datetime([1, 2]),
+            "target": ["a", "a"],
+            "delay": [1.0, 2.0],
+            "status": ["ok", "ok"],
+        }
+    )
+    writer.add(df)
+    writer.write()
+    assert len(writer.pending) == 1
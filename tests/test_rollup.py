@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+import rollup
+from rollup import HOUR, MINUTE, Rollup
+
+
+def pings(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    times = pd.Timestamp("2023-01-01").value + np.sort(
+        rng.integers(0, 3 * 24 * HOUR, n)
+    )
+    delays = rng.lognormal(3, 0.5, n)
+    delays[rng.random(n) < 0.05] = np.inf
+    delays[rng.random(n) < 0.01] = np.nan
+    return pd.DataFrame({"time": pd.to_datetime(times), "delay": delays})
+
+
+def assert_same(a, b):
+    assert a.period == b.period
+    for field in Rollup.FIELDS:
+        np.testing.assert_allclose(getattr(a, field), getattr(b, field))
+
+
+def test_merge_of_the_parts_is_the_rollup_of_the_whole():
+    df = pings()
+    whole = Rollup.from_pings(df)
+    # the parts share the hour they are split in
+    first, second = df.iloc[:2500], df.iloc[2500:]
+    assert_same(
+        Rollup.from_pings(first).merge(Rollup.from_pings(second)), whole
+    )
+    assert whole.count.sum() == len(df)
+    assert whole.timeouts.sum() == np.isinf(df["delay"]).sum()
+    assert whole.hist.sum() == np.isfinite(df["delay"]).sum()
+
+
+def test_coarsen_minutes_to_hours():
+    df = pings()
+    minutes = Rollup.from_pings(df, MINUTE)
+    assert_same(minutes.coarsen(HOUR), Rollup.from_pings(df))
+
+
+def test_quantile_is_close_to_the_exact_one():
+    df = pings()
+    cells = Rollup.from_pings(df).coarsen(24 * HOUR)
+    delays = df["delay"].to_numpy()
+    days = df["time"].dt.floor("D").to_numpy()
+    for day, median in zip(np.unique(days), cells.quantile(0.5)):
+        day_delays = delays[(days == day) & np.isfinite(delays)]
+        assert abs(median / np.median(day_delays) - 1) < 0.05
+
+
+def test_update_rollup_adds_to_the_saved_cells():
+    df = pings()
+    df["target"] = np.arange(len(df)) % 2
+    rollup.write_rollup(df.iloc[:3000])
+    rollup.update_rollup(df.iloc[3000:])
+
+    assert rollup.rollup_files() == [
+        rollup.ROLLUP_PATH,
+        rollup.rollup_file(rollup.ROLLUP_PATH, 1),
+    ]
+    for target in (0, 1):
+        assert_same(
+            Rollup.load(rollup.rollup_file(rollup.ROLLUP_PATH, target)),
+            Rollup.from_pings(df[df["target"] == target]),
+        )
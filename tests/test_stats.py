@@ -0,0 +1,26 @@
+import numpy as np
+
+from records import ERROR, OK, TIMEOUT
+from stats import Distribution
+
+
+def test_percentiles_match_numpy():
+    rng = np.random.default_rng(0)
+    for n in (1, 2, 7, 1000):
+        delays = rng.exponential(20, n)
+        dist = Distribution(delays, np.full(n, OK))
+        q = [0, 1, 25, 50, 95, 99, 100]
+        np.testing.assert_allclose(
+            dist.percentiles(q), np.percentile(delays, q)
+        )
+        assert np.isclose(dist.percentiles(50), np.median(delays))
+
+
+def test_lost_and_unknown_delays():
+    delays = np.array([3.0, np.inf, np.nan, 1.0, np.inf, 2.0])
+    status = np.array([OK, TIMEOUT, OK, OK, ERROR, OK])
+    dist = Distribution(delays, status)
+    assert (dist.sent, dist.lost, len(dist)) == (6, 2, 3)
+    assert dist.percentiles([0, 50, 100]).tolist() == [1.0, 2.0, 3.0]
+    assert dist.cdf([1.0, 3.5]).tolist() == [0, 3 / 6]
+    assert np.isnan(Distribution([np.inf], [TIMEOUT]).percentiles(50))
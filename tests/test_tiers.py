@@ -0,0 +1,95 @@
+import os
+import shutil
+
+import numpy as np
+
+import analysis
+import collector
+import rollup
+import store
+import tiers
+from conftest import write_log
+
+DAY = 1440
+
+
+def rollup_count():
+    return int(rollup.Rollup.load().count.sum())
+
+
+def ingest(full=False):
+    df, _ = analysis.ingest(
+        "pinger.log", store.STORE_PATH, "pings.state.json", full=full
+    )
+    return len(df)
+
+
+def test_compact_keeps_the_totals():
+    write_log("pinger.log", 3 * DAY)
+    assert ingest(full=True) == 3 * DAY
+
+    summarized, _ = tiers.compact(raw_days=1, now="2023-01-03 12:00")
+
+    assert summarized == ["2023-01-01"]
+    assert store.days() == ["2023-01-02", "2023-01-03"]
+    assert tiers.read_cells().count.sum() == DAY
+    assert len(store.read_pings()) == 2 * DAY
+    assert rollup_count() == 3 * DAY
+    times, _ = store.open_arrays()
+    assert times[0] == tiers.load_retention()["raw_since"]
+
+
+def test_ingest_after_compact_and_copytruncate():
+    write_log("pinger.log", 3 * DAY)
+    ingest(full=True)
+    tiers.compact(raw_days=1, now="2023-01-03 12:00")
+
+    # logrotate copytruncate: the old log is copied, the log emptied in
+    # place and written again
+    shutil.copy("pinger.log", "pinger.log.1")
+    data = write_log("new.log", 100, start="2023-01-04", seed=1)
+    with open("pinger.log", "r+b") as f:
+        f.truncate(0)
+        f.write(data)
+
+    assert ingest() == 100
+    assert rollup_count() == 3 * DAY + 100
+    assert len(store.read_pings()) == 2 * DAY + 100
+    assert store.days()[0] == "2023-01-02"
+    assert ingest() == 0
+
+
+def test_collector_skips_compacted_pings():
+    root = "collected"
+    write_log("pinger.log", 2 * DAY)
+    df, _ = analysis.fix_times(analysis.read_log("pinger.log"))
+    batch = collector.to_batch(df, "node")
+    c = collector.Collector(root)
+    c.receive(batch)
+    assert c.flush() == 2 * DAY
+
+    tiers.compact(root, raw_days=1, now="2023-01-03")
+    c.receive(batch)
+
+    assert c.flush() == 0
+    cells = rollup.Rollup.load(
+        rollup.rollup_file(os.path.join(root, rollup.ROLLUP_PATH), 1)
+    )
+    assert cells.count.sum() == 2 * DAY
+    assert np.all(
+        store.read_pings(os.path.join(root, store.STORE_PATH))["time"]
+        >= np.datetime64("2023-01-02")
+    )
+
+
+def test_full_ingest_after_compact_keeps_the_tiers():
+    write_log("pinger.log", 3 * DAY)
+    ingest(full=True)
+    tiers.compact(raw_days=1, now="2023-01-03 12:00")
+
+    assert ingest(full=True) == 2 * DAY
+
+    assert store.days() == ["2023-01-02", "2023-01-03"]
+    assert len(store.open_arrays()[0]) == 2 * DAY
+    assert rollup_count() == 3 * DAY
+    assert tiers.read_cells().count.sum() == DAY
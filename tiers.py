@@ -0,0 +1,292 @@
+"""
+Tiered retention of the ping history
+
+    python tiers.py [--raw-days 30] [--minute-days 365] [--every SECONDS]
+
+The pings are kept in three tiers of decreasing resolution:
+
+    raw      pings.parquet and pings.bin, every ping, for --raw-days
+    minute   pings.minutes/day=.../part-0.parquet, one cell per minute
+             and target, for --minute-days
+    hour     pings.rollup*.npz, one cell per hour and target, forever
+
+A cell has the number of pings and of timeouts, the sum, min and max of
+the delays and the delay histogram of rollup.py, which is the quantile
+sketch (stored sparse in the minute tier: the buckets that are not empty
+and their counts). Ingest keeps the hour tier up to date; compact()
+summarizes the raw partitions of the days older than --raw-days into
+the minute tier and then drops them, and drops the minute partitions of
+the days older than --minute-days. pings.retention records since when
+every tier is complete, so readers know which tier holds what.
+
+Readers pick the coarsest tier that is fine enough: the hour tier when
+a time bin of the figure is an hour or longer, else the raw pings where
+they are kept, the minute cells before that and the hourly ones before
+those (see cells_before and LiveData.points).
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+import metrics
+import store
+from rollup import HOUR, MINUTE, N_BUCKETS, Rollup, target_groups
+
+MINUTES_PATH = "pings.minutes"
+RETENTION_PATH = "pings.retention"
+
+RAW_DAYS = 30
+MINUTE_DAYS = 365
+
+DAY = 24 * HOUR
+
+MINUTE_SCHEMA = pa.schema(
+    [
+        ("time", pa.timestamp("ns")),
+        ("target", pa.uint16()),
+        ("count", pa.int64()),
+        ("timeouts", pa.int64()),
+        ("total", pa.float64()),
+        ("low", pa.float64()),
+        ("high", pa.float64()),
+        ("buckets", pa.list_(pa.uint8())),
+        ("counts", pa.list_(pa.int32())),
+    ]
+)
+
+
+def load_retention(path=RETENTION_PATH):
+    """
+    Since when (epoch ns) the raw and the minute tiers are complete, 0
+    when nothing was ever compacted
+    """
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"raw_since": 0, "minutes_since": 0}
+
+
+def save_retention(retention, path=RETENTION_PATH):
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(retention, f)
+    os.replace(tmp_file, path)
+
+
+def compacted(df, path=RETENTION_PATH):
+    """
+    Which pings of df are older than the raw tier, so they are already in
+    the minute and hour tiers and must not be added again
+    """
+    raw_since = load_retention(path)["raw_since"]
+    return df["time"].to_numpy().view(np.int64) < raw_since
+
+
+def unseen(df, root=""):
+    """
+    The pings of df, with their targets as codes, that are neither in the
+    store in root yet nor older than its raw tier
+    """
+    df = store.encode_targets(df, os.path.join(root, store.TARGETS_PATH))
+    seen = store.stored(df, os.path.join(root, store.ARRAYS_PATH))
+    return df[~(seen | compacted(df, os.path.join(root, RETENTION_PATH)))]
+
+
+def add_new_pings(df, root=""):
+    """
+    Add the pings of df that are not in the store in root (see unseen) to
+    it, returns their number, so the same logs can be added again
+    """
+    df = unseen(df, root)
+    store.add_pings(df, root)
+    return len(df)
+
+
+def cells_table(cells, target):
+    """
+    The minute cells of a target as a table of the minute schema
+    """
+    rows, buckets = np.nonzero(cells.hist)
+    offsets = np.searchsorted(rows, np.arange(len(cells) + 1)).astype(np.int32)
+    return pa.table(
+        {
+            "time": cells.times.view("datetime64[ns]"),
+            "target": np.full(len(cells), target, np.uint16),
+            "count": cells.count,
+            "timeouts": cells.timeouts,
+            "total": cells.total,
+            "low": cells.low,
+            "high": cells.high,
+            "buckets": pa.ListArray.from_arrays(
+                offsets, pa.array(buckets.astype(np.uint8))
+            ),
+            "counts": pa.ListArray.from_arrays(
+                offsets, pa.array(cells.hist[rows, buckets])
+            ),
+        },
+        schema=MINUTE_SCHEMA,
+    )
+
+
+@metrics.timed("store_read", store="minutes")
+def read_cells(path=MINUTES_PATH, start=None, end=None, target=0):
+    """
+    The minute cells of a target between start and end (either may be
+    None) as a Rollup
+    """
+    if not os.path.isdir(path):
+        return Rollup.empty(MINUTE)
+    dataset = ds.dataset(
+        path,
+        format="parquet",
+        schema=MINUTE_SCHEMA.append(pa.field("day", pa.string())),
+        partitioning=store.PARTITIONING,
+    )
+    condition = ds.field("target") == target
+    if start is not None:
+        start = pd.Timestamp(start)
+        condition &= ds.field("day") >= start.strftime("%Y-%m-%d")
+        condition &= ds.field("time") >= start
+    if end is not None:
+        end = pd.Timestamp(end)
+        condition &= ds.field("day") <= end.strftime("%Y-%m-%d")
+        condition &= ds.field("time") <= end
+    table = dataset.to_table(
+        columns=MINUTE_SCHEMA.names, filter=condition
+    ).sort_by("time")
+    n = len(table)
+    hist = np.zeros((n, N_BUCKETS), np.int32)
+    rows = np.repeat(
+        np.arange(n), pc.list_value_length(table["buckets"]).to_numpy()
+    )
+    hist[rows, pc.list_flatten(table["buckets"]).to_numpy()] = pc.list_flatten(
+        table["counts"]
+    ).to_numpy()
+    return Rollup(
+        table["time"].to_numpy().view(np.int64) // MINUTE,
+        table["count"].to_numpy(),
+        table["timeouts"].to_numpy(),
+        table["total"].to_numpy(),
+        table["low"].to_numpy(),
+        table["high"].to_numpy(),
+        hist,
+        MINUTE,
+    )
+
+
+def cells_before(cells, end):
+    """
+    The cells that end before the epoch ns end, so they do not overlap
+    the finer tier that starts there
+    """
+    return cells.where((cells.hours + 1) * cells.period <= end)
+
+
+def cell_points(cells):
+    """
+    The fastest and the slowest ping of every cell as (time, delay) at
+    the start of the cell, and the starts of the cells with timeouts
+    """
+    replied = np.isfinite(cells.low)
+    good = pd.DataFrame(
+        {
+            "time": np.repeat(cells.times[replied], 2).view("datetime64[ns]"),
+            "delay": np.column_stack(
+                [cells.low[replied], cells.high[replied]]
+            ).ravel(),
+        }
+    )
+    bad = pd.DataFrame(
+        {"time": cells.times[cells.timeouts > 0].view("datetime64[ns]")}
+    )
+    return good, bad
+
+
+def compact(root="", raw_days=RAW_DAYS, minute_days=MINUTE_DAYS, now=None):
+    """
+    Summarize the raw partitions of the days older than raw_days into the
+    minute tier and drop them (and their pings from the arrays), and drop
+    the minute partitions of the days older than minute_days. Returns the
+    days summarized and the minute days dropped.
+    """
+    today = pd.Timestamp(now if now is not None else time.time_ns())
+    today = today.normalize()
+    raw_cutoff = today - pd.Timedelta(days=raw_days)
+    minute_cutoff = today - pd.Timedelta(days=minute_days)
+    store_path = os.path.join(root, store.STORE_PATH)
+    minutes_path = os.path.join(root, MINUTES_PATH)
+    retention_path = os.path.join(root, RETENTION_PATH)
+
+    old_days = [
+        day for day in store.days(store_path) if pd.Timestamp(day) < raw_cutoff
+    ]
+    for day in old_days:
+        df = store.read_pings(
+            store_path,
+            start=day,
+            end=pd.Timestamp(day) + pd.Timedelta(DAY - 1),
+            columns=("time", "target", "delay"),
+        )
+        table = pa.concat_tables(
+            [
+                cells_table(Rollup.from_pings(group, MINUTE), int(target))
+                for target, group in target_groups(df)
+            ]
+            or [MINUTE_SCHEMA.empty_table()]
+        )
+        # the cells of a day always come from all its pings, so doing it
+        # again replaces them
+        store.write_day(table, store.day_file(minutes_path, day))
+        store.drop_days(store_path, [day])
+    store.trim_arrays(os.path.join(root, store.ARRAYS_PATH), raw_cutoff.value)
+
+    expired = [
+        day
+        for day in store.days(minutes_path)
+        if pd.Timestamp(day) < minute_cutoff
+    ]
+    store.drop_days(minutes_path, expired)
+
+    retention = load_retention(retention_path)
+    if old_days:
+        retention["raw_since"] = max(retention["raw_since"], raw_cutoff.value)
+    if expired:
+        retention["minutes_since"] = max(
+            retention["minutes_since"], minute_cutoff.value
+        )
+    save_retention(retention, retention_path)
+    if old_days or expired:
+        store.bump_version(os.path.join(root, store.VERSION_PATH))
+    return old_days, expired
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default="")
+    parser.add_argument("--raw-days", type=int, default=RAW_DAYS)
+    parser.add_argument("--minute-days", type=int, default=MINUTE_DAYS)
+    parser.add_argument(
+        "--every", type=float, default=None, help="seconds, run forever"
+    )
+    args = parser.parse_args()
+
+    while True:
+        summarized, expired = compact(
+            args.root, args.raw_days, args.minute_days
+        )
+        print(
+            f"Summarized {len(summarized)} raw days into minutes,"
+            f" dropped {len(expired)} minute days"
+        )
+        if args.every is None:
+            break
+        time.sleep(args.every)
@@ -0,0 +1,79 @@
+"""
+Date-range lookups on the sorted ping arrays
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def to_epoch(date):
+    """
+    anything pd.Timestamp understands, as int64 epoch nanoseconds
+    """
+    return pd.Timestamp(date).value
+
+
+class TimeIndex:
+    """
+    Index over sorted (times, delays) arrays, times in epoch nanoseconds.
+
+    A date range is turned into a slice with two binary searches. The
+    positions of the timeouts are found once, so the good pings and the
+    timeouts of a range are read without scanning rows outside of it.
+    """
+
+    def __init__(self, times, delays, timeout_positions=None):
+        self.times = times
+        self.delays = delays
+        if timeout_positions is None:
+            timeout_positions = np.flatnonzero(np.isinf(delays))
+        self.timeout_positions = timeout_positions
+        self.timeout_times = times[self.timeout_positions]
+
+    def extend(self, times, delays):
+        """
+        An index over times and delays, which start with the pings of this
+        index, that only looks for timeouts among the new pings
+        """
+        n = len(self.times)
+        new_timeouts = n + np.flatnonzero(np.isinf(delays[n:]))
+        return TimeIndex(
+            times,
+            delays,
+            np.concatenate([self.timeout_positions, new_timeouts]),
+        )
+
+    def __len__(self):
+        return len(self.times)
+
+    def span(self, start, end):
+        """
+        (lo, hi) such that times[lo:hi] are the pings in [start, end]
+        """
+        lo = np.searchsorted(self.times, to_epoch(start), side="left")
+        hi = np.searchsorted(self.times, to_epoch(end), side="right")
+        return lo, hi
+
+    def good(self, start, end):
+        """
+        The pings that got a reply between start and end
+        """
+        lo, hi = self.span(start, end)
+        delays = self.delays[lo:hi]
+        replied = np.isfinite(delays)
+        return pd.DataFrame(
+            {
+                "time": self.times[lo:hi][replied].view("datetime64[ns]"),
+                "delay": delays[replied],
+            }
+        )
+
+    def timeouts(self, start, end):
+        """
+        The times of the pings that timed out between start and end
+        """
+        lo = np.searchsorted(self.timeout_times, to_epoch(start), side="left")
+        hi = np.searchsorted(self.timeout_times, to_epoch(end), side="right")
+        return pd.DataFrame(
+            {"time": self.timeout_times[lo:hi].view("datetime64[ns]")}
+        )
@@ -0,0 +1,206 @@
+"""
+Loss and delay in recurring time windows
+
+    python windows.py first=17:27-19:00@mon,wed,thu second=18:27-20:00@mon,wed,thu
+
+A window is a time-of-day range on a set of weekdays, e.g. the evening
+train on office days. Every sample gets the minute of the week it was
+taken in (0 is Monday 00:00), and a table of which windows cover each of
+the 10080 minutes of a week assigns all the samples to all their windows
+at once. The statistics of every (date, window) are then one grouped
+aggregation over the sorted assignments.
+
+Windows are half-open, [start, end), at minute resolution; a window whose
+end is before its start runs past midnight and is counted on the date it
+started.
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import store
+from records import OK, status_of
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+MINUTE = 60 * 10**9
+
+# 1970-01-01 was a Thursday
+EPOCH_MINUTE_OF_WEEK = 3 * MINUTES_PER_DAY
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+
+def minute_of_day(text):
+    """
+    "HH:MM" to minutes since midnight
+    """
+    hours, minutes = text.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+class Window:
+    def __init__(self, name, start, end, days=range(7)):
+        self.name = name
+        self.start = minute_of_day(start) if isinstance(start, str) else start
+        self.end = minute_of_day(end) if isinstance(end, str) else end
+        self.days = sorted(
+            WEEKDAYS.index(d) if isinstance(d, str) else d for d in days
+        )
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        A window from "name=HH:MM-HH:MM[@day,day,...]"
+        """
+        name, spec = spec.split("=", 1)
+        days = range(7)
+        if "@" in spec:
+            spec, days = spec.split("@")
+            days = days.split(",")
+        start, end = spec.split("-")
+        return cls(name, start, end, days)
+
+    @property
+    def length(self):
+        return (self.end - self.start) % MINUTES_PER_DAY or MINUTES_PER_DAY
+
+    def minutes(self):
+        """
+        The minutes of the week the window covers
+        """
+        return np.concatenate(
+            [
+                (day * MINUTES_PER_DAY + self.start + np.arange(self.length))
+                % MINUTES_PER_WEEK
+                for day in self.days
+            ]
+        )
+
+    def __repr__(self):
+        return (
+            f"Window({self.name!r}, {self.start // 60:02}:"
+            f"{self.start % 60:02}-{self.end // 60:02}:{self.end % 60:02},"
+            f" {','.join(WEEKDAYS[d] for d in self.days)})"
+        )
+
+
+def minute_of_week(times):
+    """
+    The minute of the week (0 is Monday 00:00) of epoch-ns times
+    """
+    return (times // MINUTE + EPOCH_MINUTE_OF_WEEK) % MINUTES_PER_WEEK
+
+
+def coverage(windows):
+    """
+    A (window, minute of the week) table of which minutes each window
+    covers
+    """
+    table = np.zeros((len(windows), MINUTES_PER_WEEK), dtype=bool)
+    for i, window in enumerate(windows):
+        table[i, window.minutes()] = True
+    return table
+
+
+def assign(times, windows):
+    """
+    The (window, sample) pairs of all the samples in every window and
+    the epoch day each window started on, for epoch-ns times
+    """
+    minutes = times // MINUTE
+    window_ids, rows = np.nonzero(coverage(windows)[:, minute_of_week(times)])
+    starts = np.array([w.start for w in windows], dtype=np.int64)
+    # the minutes since the window opened; past midnight they reach back
+    # into the previous day
+    since_start = (minutes[rows] - starts[window_ids]) % MINUTES_PER_DAY
+    days = (minutes[rows] - since_start) // MINUTES_PER_DAY
+    return window_ids, rows, days
+
+
+def window_stats(df, windows, q=(50, 95)):
+    """
+    Per date and window: count, lost, loss_rate, and the mean and q
+    percentiles of the delays of the answered pings, for a frame of time,
+    delay and optionally status
+    """
+    times = pd.to_datetime(df["time"]).to_numpy("datetime64[ns]")
+    delays = df["delay"].to_numpy(np.float64)
+    status = df["status"].to_numpy() if "status" in df else status_of(delays)
+
+    window_ids, rows, days = assign(times.view(np.int64), windows)
+    delays = delays[rows]
+    answered = status[rows] == OK
+    known = answered & ~np.isnan(delays)
+
+    groups, key = np.unique(
+        days * len(windows) + window_ids, return_inverse=True
+    )
+    n = len(groups)
+    count = np.bincount(key, minlength=n)
+    lost = count - np.bincount(key, weights=answered, minlength=n)
+    n_known = np.bincount(key, weights=known, minlength=n).astype(np.int64)
+    total = np.bincount(key, weights=np.where(known, delays, 0), minlength=n)
+
+    # sorted by group, then by delay with the unknown ones last, so the
+    # percentiles of a group are read at offsets from its first row
+    values = np.where(known, delays, np.inf)
+    order = np.lexsort((values, key))
+    values = values[order]
+    first = np.concatenate([[0], np.cumsum(count)[:-1]])
+
+    stats = pd.DataFrame(
+        {
+            "date": (groups // len(windows)).astype("datetime64[D]"),
+            "window": pd.Categorical.from_codes(
+                groups % len(windows), categories=[w.name for w in windows]
+            ),
+            "count": count,
+            "lost": lost.astype(np.int64),
+        }
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stats["loss_rate"] = stats["lost"] / count
+        stats["mean"] = total / n_known
+        for p in q:
+            position = p / 100 * (n_known - 1)
+            lo = np.floor(position).astype(np.int64)
+            hi = np.ceil(position).astype(np.int64)
+            lo_value = values[np.clip(first + lo, 0, len(values) - 1)]
+            hi_value = values[np.clip(first + hi, 0, len(values) - 1)]
+            stats[f"p{p:g}"] = np.where(
+                n_known > 0,
+                lo_value + (hi_value - lo_value) * (position - lo),
+                np.nan,
+            )
+    return stats
+
+
+def compare(stats, value="loss_rate"):
+    """
+    One column of value per window, one row per date
+    """
+    return stats.pivot(index="date", columns="window", values=value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "windows", nargs="+", help="name=HH:MM-HH:MM[@mon,tue,...]"
+    )
+    parser.add_argument("--start", default=None)
+    parser.add_argument("--end", default=None)
+    parser.add_argument("--value", default="loss_rate")
+    parser.add_argument("--target", default=store.DEFAULT_TARGET)
+    args = parser.parse_args()
+
+    windows = [Window.parse(spec) for spec in args.windows]
+    df = store.read_pings(
+        start=args.start,
+        end=args.end,
+        targets=[store.target_code(args.target)],
+    )
+    print(compare(window_stats(df, windows), args.value).to_string())